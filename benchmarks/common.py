@@ -0,0 +1,102 @@
+"""
+Synthetic inputs shared by the benchmarks.
+"""
+from __future__ import print_function, division, absolute_import
+import timeit
+import numpy as np
+import pandas as pd
+
+# regional scales, from a small county to a large metropolitan region
+SIZES = [10000, 100000, 1000000, 5000000]
+
+# parcels are looked up in chunks of this many rows, which is how large
+# regions have to be run to fit in memory
+CHUNKSIZE = 100000
+
+FEASIBILITY_COLUMNS = ['building_cost', 'building_revenue', 'building_sqft',
+                       'max_profit', 'max_profit_far', 'non_residential_sqft',
+                       'parking_config', 'residential_sqft', 'stories',
+                       'total_cost']
+
+
+def make_parcels(n, seed=0):
+    """
+    Parcels with the columns expected by SqFtProForma.lookup(), with rents,
+    land costs and zoning drawn from plausible ranges.
+    """
+    rs = np.random.RandomState(seed)
+    return pd.DataFrame(
+        {'residential': rs.uniform(10, 40, n),
+         'retail': rs.uniform(10, 40, n),
+         'office': rs.uniform(10, 40, n),
+         'industrial': rs.uniform(5, 30, n),
+         'land_cost': rs.lognormal(13, 1, n),
+         'parcel_size': rs.lognormal(9, 1, n),
+         'max_far': rs.choice([np.nan, .5, 1.0, 2.0, 4.0, 8.0], n),
+         'max_height': rs.choice([np.nan, 20.0, 50.0, 100.0], n),
+         'max_dua': rs.choice([np.nan, 10.0, 30.0, 100.0], n),
+         'ave_unit_size': rs.uniform(600, 1500, n)},
+        index=pd.Index(np.arange(n), name='parcel_id'))
+
+
+def make_feasibility(n, forms, seed=0):
+    """
+    A feasibility table shaped like the output of SqFtProForma.lookup_all(),
+    where each form is feasible on a random 60% of the parcels.
+    """
+    rs = np.random.RandomState(seed)
+    parcels = pd.Index(np.arange(n), name='parcel_id')
+    frames = []
+    for form in forms:
+        index = parcels[rs.rand(n) < .6]
+        m = len(index)
+        building_sqft = rs.lognormal(10, 1, m)
+        residential_sqft = building_sqft * rs.choice([0, .7, 1], m)
+        df = pd.DataFrame(
+            {'building_cost': building_sqft * 200,
+             'building_revenue': building_sqft * rs.uniform(200, 300, m),
+             'building_sqft': building_sqft,
+             'max_profit': rs.lognormal(12, 1, m),
+             'max_profit_far': rs.choice([.5, 1.0, 2.0, 4.0], m),
+             'non_residential_sqft': building_sqft - residential_sqft,
+             'parking_config': rs.choice(['surface', 'deck', 'underground'],
+                                         m),
+             'residential_sqft': residential_sqft,
+             'stories': rs.choice([1.0, 2.0, 4.0, 8.0], m),
+             'total_cost': building_sqft * 250},
+            index=index, columns=FEASIBILITY_COLUMNS)
+        frames.append(df)
+    return pd.concat(frames, keys=forms, axis=1)
+
+
+def run(benchmark, sizes=None):
+    """
+    Time the time_* methods of an asv benchmark class without asv, for a
+    quick check.  The first parameter of the benchmark, the number of
+    parcels, is replaced by sizes if passed.  Peak memory is only measured
+    when running with asv.
+    """
+    params = list(getattr(benchmark, 'params', []))
+    if params and not isinstance(params[0], (list, tuple)):
+        # a single parameter
+        params = [params]
+    if params and sizes is not None:
+        params[0] = sizes
+
+    combinations = [[]]
+    for values in params:
+        combinations = [c + [v] for c in combinations for v in values]
+
+    names = sorted(name for name in dir(benchmark)
+                   if name.startswith('time_'))
+    for args in combinations:
+        for name in names:
+            bench = benchmark()
+            times = []
+            for _ in range(3):
+                if hasattr(bench, 'setup'):
+                    bench.setup(*args)
+                method = getattr(bench, name)
+                times.append(timeit.timeit(lambda: method(*args), number=1))
+            print('{}.{}{}: {:.4f}s'.format(
+                benchmark.__name__, name, tuple(args), min(times)))
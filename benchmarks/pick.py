@@ -0,0 +1,70 @@
+"""
+Benchmarks of Developer, run with asv or with
+``python -m benchmarks.pick [sizes...]``.
+"""
+from __future__ import print_function, division, absolute_import
+import sys
+import numpy as np
+import pandas as pd
+
+from developer import develop
+from benchmarks.common import SIZES, make_feasibility, run
+
+FORMS = ['industrial', 'mixedoffice', 'mixedresidential', 'office',
+         'residential', 'retail']
+
+
+def make_developer(n, forms=FORMS, seed=0):
+    rs = np.random.RandomState(seed)
+    feasibility = make_feasibility(n, forms, seed)
+    index = pd.Index(np.arange(n), name='parcel_id')
+    parcel_size = pd.Series(rs.lognormal(9, 1, n), index=index)
+    ave_unit_size = pd.Series(rs.uniform(600, 1500, n), index=index)
+    current_units = pd.Series(rs.poisson(1, n), index=index)
+    # demand for about 1% of the parcels
+    return develop.Developer(feasibility, forms, int(n * .01) + 1,
+                             parcel_size, ave_unit_size, current_units,
+                             year=2020)
+
+
+class KeepFormWithMaxProfit(object):
+    params = SIZES
+    param_names = ['parcels']
+    timeout = 600
+
+    def setup(self, n):
+        self.dev = make_developer(n)
+
+    def time_keep_form_with_max_profit(self, n):
+        self.dev.keep_form_with_max_profit()
+
+    def peakmem_keep_form_with_max_profit(self, n):
+        self.dev.keep_form_with_max_profit()
+
+
+class Pick(object):
+    params = SIZES
+    param_names = ['parcels']
+    timeout = 600
+    # pick() drops the buildings it picks, so every call gets a new setup
+    number = 1
+
+    def setup(self, n):
+        self.dev = make_developer(n)
+
+    def time_pick(self, n):
+        self.dev.pick()
+
+    def peakmem_pick(self, n):
+        self.dev.pick()
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    sizes = [int(size) for size in argv] or SIZES[:2]
+    run(KeepFormWithMaxProfit, sizes)
+    run(Pick, sizes)
+
+
+if __name__ == '__main__':
+    main()
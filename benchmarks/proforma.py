@@ -0,0 +1,46 @@
+"""
+Benchmarks of SqFtProForma, run with asv or with
+``python -m benchmarks.proforma [sizes...]``.
+"""
+from __future__ import print_function, division, absolute_import
+import sys
+
+from developer import sqftproforma as sqpf
+from benchmarks.common import SIZES, CHUNKSIZE, make_parcels, run
+
+
+class ProFormaInit(object):
+    timeout = 120
+
+    def time_init(self):
+        sqpf.SqFtProForma.from_defaults()
+
+    def peakmem_init(self):
+        sqpf.SqFtProForma.from_defaults()
+
+
+class Lookup(object):
+    params = (SIZES, sqpf.SqFtProForma.get_defaults()['forms_to_test'])
+    param_names = ['parcels', 'form']
+    timeout = 1800
+
+    def setup(self, n, form):
+        self.pf = sqpf.SqFtProForma.from_defaults()
+        self.df = make_parcels(n)
+
+    def time_lookup(self, n, form):
+        self.pf.lookup(form, self.df, chunksize=CHUNKSIZE)
+
+    def peakmem_lookup(self, n, form):
+        self.pf.lookup(form, self.df, chunksize=CHUNKSIZE)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    sizes = [int(size) for size in argv] or SIZES[:2]
+    run(ProFormaInit)
+    run(Lookup, sizes)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""
+Benchmarks of Developer._select_buildings, comparing numpy.random.choice
+(the default) with exponential-key sampling (used when random_state is
+passed).  These follow the conventions of airspeed velocity (asv), but can
+also be run directly with ``python -m benchmarks.select_buildings``.
+"""
+from __future__ import print_function, division, absolute_import
+import sys
+import numpy as np
+import pandas as pd
+
+from developer import develop
+from benchmarks.common import run
+
+
+def make_candidates(n, seed=0):
+    rs = np.random.RandomState(seed)
+    df = pd.DataFrame({'net_units': rs.randint(1, 50, n).astype('float64'),
+                       'max_profit': rs.lognormal(12, 1, n),
+                       'parcel_size': rs.uniform(2000, 50000, n)},
+                      index=pd.Index(np.arange(n), name='parcel_id'))
+    df['max_profit_per_size'] = df.max_profit / df.parcel_size
+    p = df.max_profit_per_size.values / df.max_profit_per_size.sum()
+    return df, p
+
+
+class SelectBuildings(object):
+    params = ([10000, 100000, 1000000], ['choice', 'exponential'])
+    param_names = ['parcels', 'method']
+
+    def setup(self, n, method):
+        self.df, self.p = make_candidates(n)
+        # demand for a few percent of the candidate units
+        target_units = int(self.df.net_units.sum() * .02)
+        random_state = 0 if method == 'exponential' else None
+        self.dev = develop.Developer(
+            None, 'residential', target_units, None, None, None,
+            random_state=random_state)
+
+    def time_select_buildings(self, n, method):
+        self.dev._select_buildings(self.df, self.p, None)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    run(SelectBuildings, [int(size) for size in argv] or None)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,12 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+try:
+    # column names can be unicode in Python 2
+    _string_types = basestring
+except NameError:
+    _string_types = str
+
 
 class Developer(object):
     """
@@ -13,6 +19,8 @@ class Developer(object):
 
     Can also be a dictionary where keys are building forms and values are
     the individual data frames returned by the proforma lookup routine.
+    These are kept as they are, along with a long table of the (parcel,
+    form) candidates, rather than being combined into one wide DataFrame.
 
     Parameters
     ----------
@@ -24,6 +32,12 @@ class Developer(object):
         parameters passed previously to the pro forma.  If more than one form
         is passed the forms compete with each other (based on profitability)
         for which one gets built in order to meet demand.
+    target_units : int, Series or dict
+        The number of net units (or job spaces if residential is False) to
+        build, or the number to build in each zone keyed by zone, in which
+        case zones must be passed.  Buildings are then selected for all
+        zones at once by exponential-key sampling within each zone (see
+        random_state).
     parcel_size : series
         The size of the parcels.  This was passed to feasibility as well,
         but should be passed here as well.  Index should be parcel_ids.
@@ -51,7 +65,10 @@ class Developer(object):
     drop_after_build : bool
         Whether or not to drop parcels from consideration after they
         have been chosen for development.  Usually this is true so as
-        to not develop the same parcel twice.
+        to not develop the same parcel twice.  Built parcels are only
+        marked as dropped, and the feasibility table is compacted once
+        more than compact_fraction of its rows are dropped, so that picking
+        repeatedly does not copy the whole table each time.
     residential: bool
         If creating non-residential buildings set this to false and
         developer will fill in job_spaces rather than residential_units
@@ -60,6 +77,22 @@ class Developer(object):
         computing it internally by using the length of agents adn the sum of
         the relevant supply columin - this trusts the caller to know how to
         compute this.
+    random_state : int or numpy.random.Generator, optional
+        If passed, buildings are selected by exponential-key (Efraimidis-
+        Spirakis) sampling drawn from this seed or generator, which is much
+        faster for large sets of candidates and reproducible.  Otherwise
+        numpy.random.choice is used as before, which draws from the global
+        numpy random state.
+    zones : str or Series, optional
+        The zone of each building, when target_units is given per zone -
+        either the name of a column of the feasibility table (e.g. one
+        passed through the pro forma) or a Series indexed by parcel_id.
+        Buildings in zones without a target are not built.
+    current_job_spaces : series, optional
+        The current number of job spaces on the parcel, used instead of
+        current_units for the net job spaces when picking residential and
+        non-residential buildings together (see pick()).  Parcels without
+        a value have no job spaces.
 
     """
 
@@ -68,11 +101,9 @@ class Developer(object):
                  year=None, bldg_sqft_per_job=400.0,
                  min_unit_size=400, max_parcel_size=200000,
                  drop_after_build=True, residential=True,
-                 num_units_to_build=None):
+                 num_units_to_build=None, random_state=None, zones=None,
+                 current_job_spaces=None):
 
-        if isinstance(feasibility, dict):
-            feasibility = pd.concat(feasibility.values(),
-                                    keys=feasibility.keys(), axis=1)
         self.feasibility = feasibility
         self.forms = forms
         self.target_units = target_units
@@ -86,6 +117,134 @@ class Developer(object):
         self.drop_after_build = drop_after_build
         self.residential = residential
         self.num_units_to_build = num_units_to_build
+        self.random_state = random_state
+        self._rng = (None if random_state is None
+                     else np.random.default_rng(random_state))
+        self.zones = zones
+        self.current_job_spaces = current_job_spaces
+
+    # Share of the rows of the feasibility table which can be marked as
+    # dropped before the table is compacted
+    compact_fraction = .25
+
+    @property
+    def feasibility(self):
+        """
+        The feasibility table, without the buildings dropped after being
+        built.  Setting it replaces the table.  If the table was passed as
+        a dict of forms, this combines the forms into one DataFrame with
+        hierarchical columns.
+
+        """
+        if self._view is None:
+            if self._frames is None:
+                self._view = self._available_rows(self._feasibility)
+            else:
+                self._view = pd.concat(
+                    [self._available_form(form) for form in self._frames],
+                    keys=list(self._frames), axis=1)
+        return self._view
+
+    @feasibility.setter
+    def feasibility(self, feasibility):
+        if isinstance(feasibility, dict):
+            self._frames = dict(feasibility)
+            self._feasibility = None
+            self._index_candidates()
+        else:
+            self._frames = None
+            self._feasibility = feasibility
+            self._parcels = (pd.Index([]) if feasibility is None
+                             else feasibility.index)
+        self._available = np.ones(len(self._parcels), dtype='bool')
+        self._dropped = 0
+        self._view = None
+
+    def _index_candidates(self):
+        """
+        Build the long table of candidates for a dict of forms, with one
+        row per parcel and form: the position of the parcel in the union
+        of the parcels of all forms (which is the index of the combined
+        feasibility table), the form as a categorical, the row of the
+        parcel in the DataFrame of the form and its max_profit.
+
+        """
+        parcels = pd.Index([])
+        for df in self._frames.values():
+            parcels = df.index if len(parcels) == 0 else parcels.union(
+                df.index, sort=False)
+        self._parcels = parcels
+
+        forms = sorted(self._frames)
+        codes, positions, rows, profits = [], [], [], []
+        self._form_positions = {}
+        for i, form in enumerate(forms):
+            df = self._frames[form]
+            # the rows of the form in the order of the combined table
+            form_positions = parcels.get_indexer(df.index)
+            order = np.argsort(form_positions, kind='mergesort')
+            self._form_positions[form] = (order, form_positions[order])
+            if 'max_profit' not in df.columns:
+                continue
+            codes.append(np.full(len(df), i))
+            positions.append(form_positions)
+            rows.append(np.arange(len(df)))
+            profits.append(df.max_profit.values.astype('float64'))
+
+        def concat(arrs, dtype):
+            return np.concatenate(arrs) if arrs else np.array([], dtype)
+
+        self._long = pd.DataFrame({
+            'parcel': concat(positions, 'int64'),
+            'form': pd.Categorical.from_codes(concat(codes, 'int64'),
+                                              forms),
+            'row': concat(rows, 'int64'),
+            'max_profit': concat(profits, 'float64')})
+
+    def _available_form(self, form):
+        """
+        The rows of the DataFrame of a form, for a dict of forms, that have
+        not been dropped, in the order of the combined feasibility table.
+
+        """
+        df = self._frames[form]
+        rows, positions = self._form_positions[form]
+        rows = rows[self._available[positions]]
+        if len(rows) == len(df) and (rows[1:] > rows[:-1]).all():
+            return df
+        return df.iloc[rows]
+
+    def _is_empty(self):
+        """
+        Whether there are no buildings left in the feasibility table.
+
+        """
+        if not self._available.any():
+            return True
+        if self._frames is None:
+            return self._feasibility.empty
+        return all(df.empty for df in self._frames.values())
+
+    def _available_rows(self, df):
+        """
+        The rows of df, which is a selection of columns of the full
+        feasibility table, that have not been dropped.
+
+        """
+        if self._dropped == 0:
+            return df
+        return df.iloc[np.flatnonzero(self._available)]
+
+    def _compact(self):
+        """
+        Remove the dropped rows from the feasibility table.
+
+        """
+        if self._frames is None:
+            self.feasibility = self.feasibility
+        else:
+            self.feasibility = {form: self._available_form(form)
+                                for form in self._frames}
 
     @classmethod
     def from_yaml(cls, feasibility, forms, target_units,
@@ -116,6 +275,46 @@ class Developer(object):
         logger.debug('loaded Developer model from YAML')
         return model
 
+    @classmethod
+    def from_parquet(cls, path, forms, target_units, parcel_size,
+                     ave_unit_size, current_units, columns=None,
+                     memory_map=True, **kwargs):
+        """
+        Create a Developer from a feasibility table written by
+        SqFtProForma.lookup_to_parquet(), only reading the forms that are
+        picked from.  This requires pyarrow.
+
+        Parameters
+        ----------
+        path : str or file like
+            The Parquet file
+        forms, target_units, parcel_size, ave_unit_size, current_units
+            As described in the constructor.  If forms is None, every form
+            in the file is read.
+        columns : list of strings, optional
+            The attributes to read for each form, by default all of them.
+            The ones used by pick() (see pick_columns) are always read.
+        memory_map : bool, optional
+            Whether to memory map the file rather than reading it into
+            memory
+        kwargs
+            Other arguments of the constructor
+
+        Returns
+        -------
+        Developer object
+        """
+        if columns is not None:
+            columns = list(columns) + [col for col in cls.pick_columns
+                                       if col not in columns]
+        feasibility = utils.read_parquet(path, forms, columns, memory_map)
+        return cls(feasibility, forms, target_units, parcel_size,
+                   ave_unit_size, current_units, **kwargs)
+
+    # Feasibility attributes used by pick()
+    pick_columns = ['max_profit', 'max_profit_far', 'residential_sqft',
+                    'non_residential_sqft', 'stories']
+
     @property
     def to_dict(self):
         """
@@ -153,11 +352,21 @@ class Developer(object):
         logger.debug('serializing Developer model to YAML')
         return utils.convert_to_yaml(self.to_dict, str_or_buffer)
 
-    def pick(self, profit_to_prob_func=None, custom_selection_func=None):
+    def pick(self, profit_to_prob_func=None, custom_selection_func=None,
+             target_job_spaces=None):
         """
         Choose the buildings from the list that are feasible to build in
         order to match the specified demand.
 
+        If target_job_spaces is passed, residential and non-residential
+        buildings are picked together from one set of candidates (the most
+        profitable of self.forms on each parcel), rather than by two
+        Developers over the same parcels.  target_units is then the number
+        of residential units to build whatever residential is, and the
+        residential demand is met first.  The job spaces of the buildings
+        picked for it count towards target_job_spaces, and the rest of the
+        job spaces are picked from the parcels which are left.
+
         Parameters
         ----------
         profit_to_prob_func: function
@@ -171,45 +380,210 @@ class Developer(object):
             development after probabilities are calculated. Must have
             parameters (self, df, p) and return a numpy array of buildings to
             build (i.e. df.index.values)
+        target_job_spaces : int, optional
+            The number of net job spaces to build along with target_units
+            residential units
 
         Returns
         -------
         None if there are no feasible buildings
         new_buildings : dataframe
             DataFrame of buildings to add.  These buildings are rows from the
-            DataFrame that is returned from feasibility.
+            DataFrame that is returned from feasibility.  If target_job_spaces
+            is passed, net_units are residential units and net_job_spaces
+            is added.
+        """
+        with utils.span('pick'):
+            return self._pick(profit_to_prob_func, custom_selection_func,
+                              target_job_spaces)
+
+    def _pick(self, profit_to_prob_func, custom_selection_func,
+              target_job_spaces=None):
+        """
+        Helper method to pick(), with the parameters described there.
+
         """
-        df = self.feasibility
         empty_warn = "WARNING THERE ARE NO FEASIBLE BUILDINGS TO CHOOSE FROM"
 
-        if len(df) == 0 or df.empty:
+        if self._is_empty():
             print(empty_warn)
             return
 
-        # Get DataFrame of potential buildings from SqFtProForma steps
-        df = self._get_dataframe_of_buildings()
-        df = self._remove_infeasible_buildings(df)
-        df = self._calculate_net_units(df)
-
-        if len(df) == 0 or df.empty:
+        joint = target_job_spaces is not None
+        p, df = self._candidates(profit_to_prob_func, joint)
+        if df is None:
             print(empty_warn)
             return
 
         print("Sum of net units that are profitable: {:,}".format(
-            int(df.net_units.sum())))
+            int(df.net_units.clip(lower=0).sum())))
 
-        # Generate development probabilities and pick buildings to build
-        p, df = self._calculate_probabilities(df, profit_to_prob_func)
-        build_idx = self._select_buildings(df, p, custom_selection_func)
+        # Pick buildings to build
+        with utils.span('pick.selection'):
+            if joint and custom_selection_func is None:
+                build_idx = self._select_joint_buildings(df, p,
+                                                         target_job_spaces)
+            else:
+                build_idx = self._select_buildings(df, p,
+                                                   custom_selection_func)
 
         # Drop built buildings from self.feasibility attribute if desired
-        self._drop_built_buildings(build_idx)
+        with utils.span('pick.drop'):
+            self._drop_built_buildings(build_idx)
 
         # Prep DataFrame of new buildings
-        new_df = self._prepare_new_buildings(df, build_idx)
+        with utils.span('pick.prepare'):
+            new_df = self._prepare_new_buildings(df, build_idx)
 
         return new_df
 
+    def _candidates(self, profit_to_prob_func, joint=False):
+        """
+        Helper method to pick() and pick_replicates(). Prepares the
+        buildings that can be picked and their development probabilities.
+
+        Parameters
+        ----------
+        profit_to_prob_func : function, optional
+            As described in pick()
+        joint : bool, optional
+            Whether residential and non-residential buildings are picked
+            together, as described in _prepare_candidates()
+
+        Returns
+        -------
+        p : Series or ndarray
+            Development probability for each building
+        df : DataFrame
+            DataFrame of buildings, or None if there are none
+        """
+        # Get DataFrame of potential buildings from SqFtProForma steps
+        with utils.span('pick.reshape'):
+            df = self._get_dataframe_of_buildings()
+        with utils.span('pick.filter'):
+            df = self._prepare_candidates(df, joint)
+
+        if len(df) == 0 or df.empty:
+            return None, None
+
+        # Generate development probabilities
+        with utils.span('pick.probabilities'):
+            return self._calculate_probabilities(df, profit_to_prob_func)
+
+    def pick_replicates(self, n, profit_to_prob_func=None, random_state=None,
+                        n_jobs=None):
+        """
+        Run n independent picks from the same candidate buildings, to see
+        how uncertain the location of development is.  The candidates and
+        their probabilities are prepared once, each replicate selects
+        buildings as pick() does with random_state (by exponential-key
+        sampling) from its own random stream, and only the number of times
+        each building is picked is kept.  Unlike pick(), self.feasibility
+        is left unchanged.
+
+        Parameters
+        ----------
+        n : int
+            Number of replicates
+        profit_to_prob_func : function, optional
+            As described in pick()
+        random_state : int, numpy.random.SeedSequence or Generator, optional
+            Seed from which the stream of each replicate is spawned, by
+            default the random_state of the Developer.  Results are the same
+            for the same seed whatever n_jobs is.
+        n_jobs : int, optional
+            If greater than 1, replicates are split between this many
+            processes, or one per CPU if -1
+
+        Returns
+        -------
+        replicates : DataFrame
+            Indexed by the parcel_id of every candidate building, with the
+            columns
+
+            form
+                The form of the building, only if forms is a list
+            net_units
+                Net units of the building
+            times_built
+                Number of replicates in which the building was picked
+            build_probability
+                Share of replicates in which the building was picked
+            expected_net_units
+                Mean net units built on the parcel across replicates
+
+            None if there are no feasible buildings.
+        """
+        if self._is_empty():
+            return
+
+        with utils.span('pick_replicates'):
+            p, df = self._candidates(profit_to_prob_func)
+            if df is None:
+                return
+
+            p = np.asarray(p, dtype='float64')
+            net_units = df.net_units.values
+            zones = self._zone_groups(df)
+            if zones is not None:
+                times_built = self._replicate_counts(
+                    p, net_units, n, random_state, n_jobs, zones)
+            elif net_units.sum() < self.target_units:
+                times_built = np.full(len(df), n)
+            elif self.target_units <= 0:
+                times_built = np.zeros(len(df), dtype='int64')
+            else:
+                times_built = self._replicate_counts(
+                    p, net_units, n, random_state, n_jobs)
+
+            replicates = pd.DataFrame({'net_units': net_units,
+                                       'times_built': times_built},
+                                      index=df.index)
+            if 'form' in df.columns:
+                replicates.insert(0, 'form', df.form.values)
+            replicates.index.name = "parcel_id"
+            replicates['build_probability'] = times_built / float(n)
+            replicates['expected_net_units'] = (
+                replicates.build_probability * net_units)
+            return replicates
+
+    def _replicate_counts(self, p, net_units, n, random_state, n_jobs,
+                          zones=None):
+        """
+        Helper method to pick_replicates(). Counts how many times each
+        building is picked in n replicates, within each zone if zones (as
+        returned by _zone_groups()) are passed.
+
+        """
+        if zones is None:
+            groups, target_units = None, self.target_units
+        else:
+            groups, target_units = zones
+        if random_state is None:
+            random_state = self.random_state
+        if isinstance(random_state, np.random.Generator):
+            random_state = random_state.integers(2 ** 63)
+        if not isinstance(random_state, np.random.SeedSequence):
+            random_state = np.random.SeedSequence(random_state)
+        seeds = random_state.spawn(n)
+
+        if n_jobs is None or n_jobs == 1:
+            return _replicate_counts(p, net_units, target_units, seeds,
+                                     groups)
+
+        from concurrent.futures import ProcessPoolExecutor
+        from multiprocessing import cpu_count
+
+        if n_jobs < 0:
+            n_jobs = cpu_count()
+        batches = [seeds[i::n_jobs] for i in range(n_jobs)]
+        with ProcessPoolExecutor(n_jobs) as pool:
+            counts = pool.map(_replicate_counts, [p] * n_jobs,
+                              [net_units] * n_jobs,
+                              [target_units] * n_jobs, batches,
+                              [groups] * n_jobs)
+            return sum(counts)
+
     def _get_dataframe_of_buildings(self):
         """
         Helper method to pick(). Returns a DataFrame of buildings from
@@ -223,7 +597,10 @@ class Developer(object):
         if self.forms is None or isinstance(self.forms, list):
             df = self.keep_form_with_max_profit(self.forms)
         else:
-            df = self.feasibility[self.forms]
+            if self._frames is None:
+                df = self._available_rows(self._feasibility[self.forms])
+            else:
+                df = self._available_form(self.forms)
         return df
 
     @staticmethod
@@ -246,10 +623,42 @@ class Developer(object):
                           max_profit
                           max_profit_far
                           total_cost
+
+        Returns a Series indexed by parcel with the form that has the largest
+        value of colname, leaving out parcels where it is missing for every
+        form.  Ties go to the form which comes first alphabetically.
         """
-        df = f.stack(level=0)[[colname]].stack().unstack(level=1).reset_index(
-            level=1, drop=True)
-        return df.idxmax(axis=1)
+        forms, best, valid = Developer._max_form_positions(f, colname)
+        return pd.Series(forms[best[valid]], index=f.index[valid])
+
+    @staticmethod
+    def _max_form_positions(f, colname):
+        """
+        Array version of _max_form().  The values of colname for every form
+        are pulled into a (parcels x forms) array and reduced with a single
+        argmax.
+
+        Returns
+        -------
+        forms : ndarray
+            The forms, sorted
+        best : ndarray
+            For each row of f, the position in forms of the form with the
+            largest value of colname
+        valid : ndarray
+            For each row of f, whether colname is present for any form
+        """
+        forms = np.array(sorted(f.columns.get_level_values(0).unique()),
+                         dtype='object')
+        values = np.full((len(f), len(forms)), np.nan)
+        for i, form in enumerate(forms):
+            if (form, colname) in f.columns:
+                values[:, i] = f[(form, colname)].values
+
+        missing = np.isnan(values)
+        valid = ~missing.all(axis=1)
+        values[missing] = -np.inf
+        return forms, values.argmax(axis=1), valid
 
     def keep_form_with_max_profit(self, forms=None):
         """
@@ -266,83 +675,182 @@ class Developer(object):
         Returns
         -------
         DataFrame consisting of a subset of self.feasibility, where only
-        the most profitable form for each parcel is included.
+        the most profitable form for each parcel is included.  It is indexed
+        by parcel_id, in sorted order, and has a form column followed by the
+        attribute columns of the forms in alphabetical order.
 
         """
-        f = self.feasibility
+        if self._frames is not None:
+            return self._keep_form_with_max_profit_long(forms)
+
+        # work on the full table, leaving out the dropped rows as invalid
+        f = self._feasibility
 
         if forms is not None:
             f = f[forms]
 
-        if len(f) > 0:
-            mu = self._max_form(f, "max_profit")
-            indexes = [tuple(x) for x in mu.reset_index().values]
+        form_names, best, valid = self._max_form_positions(f, "max_profit")
+        valid &= self._available
+        attributes = sorted(f.columns.get_level_values(1).unique())
+
+        # gather the rows where each form wins with a single take per form
+        rows = np.flatnonzero(valid)
+        best = best[rows]
+        pieces = []
+        for i, form in enumerate(form_names):
+            piece = f[form].iloc[rows[best == i]].reindex(columns=attributes)
+            piece.insert(0, "form", form)
+            pieces.append(piece)
+
+        if len(pieces) > 0:
+            df = pd.concat(pieces).sort_index(kind='mergesort')
         else:
-            indexes = []
-        df = f.stack(level=0).loc[indexes]
-        df.index.names = ["parcel_id", "form"]
-        df = df.reset_index(level=1)
+            df = pd.DataFrame(columns=["form"] + attributes)
+        df.index.name = "parcel_id"
         return df
 
-    def _remove_infeasible_buildings(self, df):
+    def _keep_form_with_max_profit_long(self, forms):
         """
-        Helper method to pick(). Removes buildings from the DataFrame if:
-            - max_profit_far is 0 or less
-            - parcel_size is larger than max_parcel_size
-
-        Also calculates useful DataFrame columns from object attributes
-        for later calculations.
+        Version of keep_form_with_max_profit() for a dict of forms, which
+        finds the best form of each parcel with a grouped argmax over the
+        long table of candidates and takes the winning rows from the
+        DataFrame of each form.
 
-        Parameters
-        ----------
-        df : DataFrame
-            DataFrame of buildings from _get_dataframe_of_buildings()
-
-        Returns
-        -------
-        df : DataFrame
         """
-        if len(df) == 0 or df.empty:
-            return df
-
-        df = df[df.max_profit_far > 0]
-        self.ave_unit_size[
-            self.ave_unit_size < self.min_unit_size
-        ] = self.min_unit_size
-        df.loc[:, 'ave_unit_size'] = self.ave_unit_size
-        df.loc[:, 'parcel_size'] = self.parcel_size
-        df.loc[:, 'current_units'] = self.current_units
-        df = df[df.parcel_size < self.max_parcel_size]
-
-        df['residential_units'] = (df.residential_sqft /
-                                   df.ave_unit_size).round()
-        df['job_spaces'] = (df.non_residential_sqft /
-                            self.bldg_sqft_per_job).round()
+        long = self._long
+        form_names = long.form.cat.categories
+        codes = long.form.cat.codes.values
+        parcels = long.parcel.values
+        profits = long.max_profit.values
 
+        keep = self._available[parcels] & ~np.isnan(profits)
+        if forms is not None:
+            keep &= np.isin(codes, form_names.get_indexer(forms))
+        candidates = np.flatnonzero(keep)
+
+        # scatter the candidates into a (parcels x forms) array and reduce
+        # it with an argmax, where ties go to the form which comes first
+        # alphabetically
+        grouped = np.full((len(self._parcels), len(form_names)), -np.inf)
+        grouped[parcels[candidates], codes[candidates]] = profits[candidates]
+        entries = np.full(grouped.shape, -1)
+        entries[parcels[candidates], codes[candidates]] = candidates
+
+        valid = np.zeros(len(self._parcels), dtype='bool')
+        valid[parcels[candidates]] = True
+        rows = np.flatnonzero(valid)
+        best = entries[rows, grouped[rows].argmax(axis=1)]
+
+        selected = form_names if forms is None else forms
+        attributes = sorted(set().union(*[self._frames[form].columns
+                                          for form in selected]))
+        pieces = []
+        for i in np.unique(codes[best]):
+            form = form_names[i]
+            rows = long.row.values[best[codes[best] == i]]
+            piece = self._frames[form].iloc[rows].reindex(columns=attributes)
+            piece.insert(0, "form", form)
+            pieces.append(piece)
+
+        if len(pieces) > 0:
+            df = pd.concat(pieces).sort_index(kind='mergesort')
+        else:
+            df = pd.DataFrame(columns=["form"] + attributes)
+        df.index.name = "parcel_id"
         return df
 
-    def _calculate_net_units(self, df):
+    def _prepare_candidates(self, df, joint=False):
         """
-        Helper method to pick(). Calculates the net_units column,
-        and removes buildings that have net_units of 0 or less.
+        Helper method to pick(). Adds the parcel and unit columns to the
+        buildings and removes the ones that cannot be built, which are
+        those where:
+            - max_profit_far is 0 or less
+            - parcel_size is larger than max_parcel_size
+            - net_units is 0 or less
+
+        The parcel values are aligned with the buildings once, all the
+        columns and the mask are computed on arrays in one pass, and the
+        filtered DataFrame is only created at the end.  ave_unit_size is
+        raised to min_unit_size without changing the Series passed to the
+        constructor.
+
+        If joint is True, net_units are always residential units, the net
+        job spaces (over current_job_spaces) are added as net_job_spaces,
+        and the buildings are kept if either is more than 0.
 
         Parameters
         ----------
         df : DataFrame
-            DataFrame of buildings from _remove_infeasible_buildings()
+            DataFrame of buildings from _get_dataframe_of_buildings()
+        joint : bool, optional
+            Whether residential and non-residential buildings are picked
+            together
 
         Returns
         -------
         df : DataFrame
+            The buildings that can be built, with the columns
+            ave_unit_size, parcel_size, current_units, residential_units,
+            job_spaces and net_units added
         """
         if len(df) == 0 or df.empty:
             return df
 
-        if self.residential:
-            df['net_units'] = df.residential_units - df.current_units
+        positions = []
+
+        def align(series):
+            # the parcel Series usually share their index, so the positions
+            # of the buildings are looked up once
+            found = next((found for index, found in positions
+                          if index is series.index), None)
+            if found is None:
+                found = series.index.get_indexer(df.index)
+                positions.append((series.index, found))
+            if (found >= 0).all():
+                return series.values[found]
+            return series.reindex(df.index).values
+
+        ave_unit_size = align(self.ave_unit_size)
+        ave_unit_size = np.where(ave_unit_size < self.min_unit_size,
+                                 self.min_unit_size, ave_unit_size)
+        parcel_size = align(self.parcel_size)
+        current_units = align(self.current_units)
+
+        residential_units = np.round(df.residential_sqft.values /
+                                     ave_unit_size)
+        job_spaces = np.round(df.non_residential_sqft.values /
+                              self.bldg_sqft_per_job)
+        if self.residential or joint:
+            net_units = residential_units - current_units
         else:
-            df['net_units'] = df.job_spaces - df.current_units
-        return df[df.net_units > 0]
+            net_units = job_spaces - current_units
+
+        columns = {'ave_unit_size': ave_unit_size,
+                   'parcel_size': parcel_size,
+                   'current_units': current_units,
+                   'residential_units': residential_units,
+                   'job_spaces': job_spaces,
+                   'net_units': net_units}
+
+        with np.errstate(invalid='ignore'):
+            if joint:
+                net_job_spaces = job_spaces
+                if self.current_job_spaces is not None:
+                    net_job_spaces = job_spaces - \
+                        self.current_job_spaces.reindex(
+                            df.index, fill_value=0).values
+                columns['net_job_spaces'] = net_job_spaces
+                built = (net_units > 0) | (net_job_spaces > 0)
+            else:
+                built = net_units > 0
+            keep = ((df.max_profit_far.values > 0) &
+                    (parcel_size < self.max_parcel_size) & built)
+        rows = np.flatnonzero(keep)
+
+        df = df.iloc[rows].copy(deep=False)
+        for col, values in columns.items():
+            df[col] = values[rows]
+        return df
 
     @staticmethod
     def _calculate_probabilities(df, profit_to_prob_func):
@@ -353,8 +861,8 @@ class Developer(object):
         Parameters
         ----------
         df : DataFrame
-            DataFrame of buildings, prepared via _get_dataframe_of_buildings,
-            _remove_infeasible_buildings, and _calculate_net_units methods
+            DataFrame of buildings, prepared via _get_dataframe_of_buildings
+            and _prepare_candidates methods
         profit_to_prob_func : function, optional
             Function to calculate development probabilities for each building
 
@@ -398,13 +906,19 @@ class Developer(object):
         """
 
         if custom_selection_func is not None:
-            build_idx = custom_selection_func(self, df, p)
+            return custom_selection_func(self, df, p)
+
+        zones = self._zone_groups(df)
+        if zones is not None:
+            build_idx = self._sample_zone_buildings(df, p, *zones)
         elif df.net_units.sum() < self.target_units:
             print("WARNING THERE WERE NOT ENOUGH PROFITABLE UNITS TO",
                   "MATCH DEMAND")
             build_idx = df.index.values
         elif self.target_units <= 0:
             build_idx = []
+        elif self._rng is not None:
+            build_idx = self._sample_buildings(df, p)
         else:
             # we don't know how many developments we will need, as they differ
             # in net_units. If all developments have net_units of 1 than we
@@ -421,10 +935,234 @@ class Developer(object):
 
         return build_idx
 
+    def _sample_buildings(self, df, p):
+        """
+        Helper method to _select_buildings(). Draws buildings without
+        replacement with probability p until target_units is met.
+
+        Each building gets the key E / p with E drawn from a unit
+        exponential distribution, and sorting the keys gives the same
+        distribution as drawing one building at a time in proportion to p
+        (Efraimidis-Spirakis sampling).  Only the smallest keys are sorted,
+        starting with as many buildings as are expected to be needed and
+        doubling until they have enough net units.
+
+        Parameters
+        ----------
+        df : DataFrame
+            DataFrame of buildings from _calculate_probabilities method
+        p : Series
+            Probabilities from _calculate_probabilities method
+
+        Returns
+        -------
+        build_idx : ndarray
+            Index of buildings selected for development, in the order they
+            were drawn
+        """
+        positions = self._sample_positions(np.asarray(p, dtype='float64'),
+                                           df.net_units.values,
+                                           self.target_units, self._rng)
+        return df.index.values[positions]
+
+    def _select_joint_buildings(self, df, p, target_job_spaces):
+        """
+        Helper method to pick(). Selects buildings to meet both
+        target_units residential units and target_job_spaces job spaces.
+        Every building gets one exponential key as in _sample_buildings(),
+        so the buildings are drawn in the same order for both demands.
+        The buildings with residential units are drawn until target_units
+        is met, then the rest of the buildings with job spaces until the
+        job spaces still needed are met.
+
+        Parameters
+        ----------
+        df : DataFrame
+            DataFrame of buildings from _calculate_probabilities method,
+            with net_job_spaces
+        p : Series
+            Probabilities from _calculate_probabilities method
+        target_job_spaces : int
+            The number of net job spaces to build
+
+        Returns
+        -------
+        build_idx : ndarray
+            Index of buildings selected for development, the residential
+            ones first
+        """
+        if isinstance(self.target_units, (pd.Series, dict)):
+            raise ValueError('per-zone target_units are not supported when '
+                             'picking residential and non-residential '
+                             'buildings together')
+
+        p = np.asarray(p, dtype='float64')
+        net_units = df.net_units.values
+        net_job_spaces = df.net_job_spaces.values
+
+        rng = self._rng if self._rng is not None else np.random
+        with np.errstate(invalid='ignore'):
+            candidates = np.flatnonzero(p > 0)
+        keys = rng.standard_exponential(len(candidates)) / p[candidates]
+        order = candidates[np.argsort(keys, kind='stable')]
+
+        units = net_units[order]
+        residential = self._cut(units > 0, units, self.target_units,
+                                "UNITS")
+        jobs = net_job_spaces[order]
+        # job spaces already built in residential buildings (e.g. mixed
+        # use) count towards the job spaces target
+        target_job_spaces -= jobs[residential].clip(min=0).sum()
+        non_residential = self._cut((jobs > 0) & ~residential, jobs,
+                                    target_job_spaces, "JOB SPACES")
+
+        return df.index.values[np.r_[order[residential],
+                                     order[non_residential]]]
+
+    @staticmethod
+    def _cut(pool, values, target, name):
+        """
+        Helper method to _select_joint_buildings(). The buildings in pool
+        (a mask over buildings in the order they were drawn) which are
+        drawn before target is met by the cumulative sum of values.
+
+        """
+        if target <= 0:
+            return np.zeros(len(pool), dtype='bool')
+        drawn = np.where(pool, values, 0).cumsum()
+        if len(drawn) == 0 or drawn[-1] < target:
+            print("WARNING THERE WERE NOT ENOUGH PROFITABLE {} TO".format(
+                name), "MATCH DEMAND")
+        # the building that meets the target is the last one built
+        return pool & (drawn - values < target)
+
+    def _zone_groups(self, df):
+        """
+        Helper method to _select_buildings(). For per-zone target_units,
+        the position of the zone of each building in the targets (-1 for
+        zones without a target) and the array of targets.
+
+        Returns
+        -------
+        None if target_units is a single number, otherwise
+        groups : ndarray
+        targets : ndarray
+        """
+        if not isinstance(self.target_units, (pd.Series, dict)):
+            return None
+        if self.zones is None:
+            raise ValueError('zones must be passed with per-zone '
+                             'target_units')
+
+        targets = pd.Series(self.target_units)
+        if isinstance(self.zones, _string_types):
+            zones = df[self.zones].values
+        else:
+            zones = self.zones.reindex(df.index).values
+        return (targets.index.get_indexer(zones),
+                targets.values.astype('float64'))
+
+    def _sample_zone_buildings(self, df, p, groups, targets):
+        """
+        Helper method to _select_buildings(). Draws buildings in every zone
+        at once until the target of each zone is met.
+
+        Parameters
+        ----------
+        df : DataFrame
+            DataFrame of buildings from _calculate_probabilities method
+        p : Series
+            Probabilities from _calculate_probabilities method
+        groups, targets : ndarray
+            As returned by _zone_groups()
+
+        Returns
+        -------
+        build_idx : ndarray
+            Index of buildings selected for development, by zone and in the
+            order they were drawn within each zone
+        """
+        p = np.asarray(p, dtype='float64')
+        net_units = df.net_units.values
+
+        with np.errstate(invalid='ignore'):
+            valid = (p > 0) & (groups >= 0)
+        supply = np.bincount(groups[valid], weights=net_units[valid],
+                             minlength=len(targets))
+        short = (supply < targets).sum()
+        if short > 0:
+            print("WARNING THERE WERE NOT ENOUGH PROFITABLE UNITS TO",
+                  "MATCH DEMAND IN {} ZONES".format(short))
+
+        rng = self._rng if self._rng is not None else np.random
+        positions = self._sample_zone_positions(p, net_units, groups,
+                                                targets, rng)
+        return df.index.values[positions]
+
+    @staticmethod
+    def _sample_zone_positions(p, net_units, groups, targets, rng):
+        """
+        Per-zone version of _sample_positions().  Every building gets an
+        exponential key as in _sample_buildings(), the buildings are sorted
+        by zone and key, and a cumulative sum of net units restarted at
+        each zone gives the buildings drawn before each zone's target is
+        met.
+
+        """
+        with np.errstate(invalid='ignore'):
+            candidates = np.flatnonzero((p > 0) & (groups >= 0))
+        keys = rng.standard_exponential(len(candidates)) / p[candidates]
+        order = candidates[np.lexsort((keys, groups[candidates]))]
+        if len(order) == 0:
+            return order
+
+        zone = groups[order]
+        units = net_units[order]
+        total = units.cumsum()
+        # units in the same zone drawn before each building
+        starts = np.flatnonzero(np.r_[True, zone[1:] != zone[:-1]])
+        before = total - units - np.repeat(
+            total[starts] - units[starts],
+            np.diff(np.r_[starts, len(order)]))
+
+        # like the single target, the building that meets the target is
+        # the last one built
+        return order[before < targets[zone]]
+
+    @staticmethod
+    def _sample_positions(p, net_units, target_units, rng):
+        """
+        Array version of _sample_buildings(), which returns the positions
+        of the buildings drawn with the Generator rng.
+
+        """
+        candidates = np.flatnonzero(p > 0)
+        if len(candidates) == 0:
+            return candidates
+        keys = rng.standard_exponential(len(candidates)) / p[candidates]
+        net_units = net_units[candidates]
+
+        n = len(candidates)
+        k = min(n, max(1, int(np.ceil(target_units / net_units.mean()))))
+        while True:
+            if k < n:
+                top = np.argpartition(keys, k - 1)[:k]
+            else:
+                top = np.arange(n)
+            order = top[np.argsort(keys[top], kind='mergesort')]
+            tot_units = net_units[order].cumsum()
+            if k == n or tot_units[-1] >= target_units:
+                break
+            k = min(n, 2 * k)
+
+        ind = int(np.searchsorted(tot_units, target_units, side="left")) + 1
+        return candidates[order[:ind]]
+
     def _drop_built_buildings(self, build_idx):
         """
         Helper method to pick(). Drops built buildings from the
-        self.feasibility attribute DataFrame.
+        self.feasibility attribute DataFrame, by marking them as dropped,
+        and compacts the table when enough of them are.
 
         Parameters
         ----------
@@ -437,8 +1175,27 @@ class Developer(object):
         None
         """
 
-        if self.drop_after_build:
-            self.feasibility = self.feasibility.drop(build_idx)
+        if not self.drop_after_build:
+            return
+
+        index = self._parcels
+        if index.is_unique:
+            positions = index.get_indexer(build_idx)
+            missing = positions < 0
+            missing[~missing] = ~self._available[positions[~missing]]
+            if missing.any():
+                raise KeyError('{} not found in feasibility'.format(
+                    list(np.asarray(build_idx)[missing])))
+            positions = np.unique(positions)
+        else:
+            positions = np.flatnonzero(index.isin(build_idx) &
+                                       self._available)
+
+        self._available[positions] = False
+        self._dropped += len(positions)
+        self._view = None
+        if self._dropped > self.compact_fraction * len(self._available):
+            self._compact()
 
     def _prepare_new_buildings(self, df, build_idx):
         """
@@ -476,3 +1233,23 @@ class Developer(object):
         new_df["stories"] = new_df.stories.apply(np.ceil)
 
         return new_df.reset_index(drop=drop)
+
+
+def _replicate_counts(p, net_units, target_units, seeds, groups=None):
+    """
+    Count how many times each building is picked by Developer.pick_replicates()
+    in the replicates drawn from seeds, which is run in worker processes.
+    If groups is passed, target_units are the targets of each zone.
+
+    """
+    counts = np.zeros(len(p), dtype='int64')
+    for seed in seeds:
+        rng = np.random.default_rng(seed)
+        if groups is None:
+            positions = Developer._sample_positions(p, net_units,
+                                                    target_units, rng)
+        else:
+            positions = Developer._sample_zone_positions(
+                p, net_units, groups, target_units, rng)
+        counts[positions] += 1
+    return counts
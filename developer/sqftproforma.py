@@ -1,13 +1,45 @@
 from __future__ import print_function, division, absolute_import
+import hashlib
 import inspect
+import json
+import os
+import tempfile
+from functools import reduce
 import numpy as np
 import pandas as pd
 import logging
+import developer
 import developer.utils as utils
 from developer.utils import columnize
 
+try:
+    import numba
+except ImportError:
+    numba = None
+
 logger = logging.getLogger(__name__)
 
+# Bump when the layout of the reference tables changes, so that tables
+# cached by previous versions are not used
+REFERENCE_CACHE_VERSION = 1
+
+# Moves a written reference cache into place - os.replace is not in
+# Python 2, where os.rename also replaces an existing file on POSIX
+_replace_file = getattr(os, 'replace', os.rename)
+
+# Declarative adjustments accepted by SqFtProForma.lookup(), applied as
+# revenue * revenue_factor + revenue_offset, and so on for costs and profit
+ADJUSTMENTS = ('revenue_factor', 'revenue_offset', 'cost_factor',
+               'cost_offset', 'profit_factor', 'profit_offset')
+
+# Prefix of the parcel columns that carry the adjustments of each form
+_ADJUSTMENT_PREFIX = '_adjustment.'
+
+# Financial parameters of the pro forma which can vary by scenario in
+# SqFtProForma.lookup_scenarios()
+FINANCE_PARAMETERS = ('cap_rate', 'interest_rate', 'loan_to_cost_ratio',
+                      'drawdown_factor', 'loan_fees')
+
 
 class SqFtProForma(object):
     """
@@ -167,6 +199,18 @@ class SqFtProForma(object):
         consideration - is typically used to remove parcels with buildings
         older than a certain date for historical preservation, but is
         generally useful
+    dtype : string (optional)
+        The floating point type used for the reference tables, the profit
+        computations and the results of lookup, e.g. 'float32' to halve
+        memory use and bandwidth at the expense of precision.  Defaults to
+        'float64'.
+    cache_dir : string (optional)
+        A directory in which to cache the reference tables.  Tables are
+        stored in a file named after a hash of the configuration (see
+        reference_hash), so they are loaded instead of computed whenever a
+        pro forma with the same configuration is created again, and a
+        change to the configuration never picks up stale tables.  This is
+        not part of the configuration saved to YAML.
 
     """
 
@@ -179,7 +223,7 @@ class SqFtProForma(object):
                  loan_to_cost_ratio, drawdown_factor, interest_rate, loan_fees,
                  residential_to_yearly=True, forms_to_test=None,
                  only_built=True, pass_through=None, simple_zoning=False,
-                 parcel_filter=None
+                 parcel_filter=None, dtype='float64', cache_dir=None
                  ):
 
         self.parcel_sizes = parcel_sizes
@@ -214,14 +258,23 @@ class SqFtProForma(object):
         self.pass_through = [] if pass_through is None else pass_through
         self.simple_zoning = simple_zoning
         self.parcel_filter = parcel_filter
+        self.dtype = np.dtype(dtype).name
 
         self.check_is_reasonable()
         self._convert_types()
 
-        reference = SqFtProFormaReference(**self.__dict__)
-        self.reference_dict = reference.reference_dict
+        self.cache_dir = cache_dir
+        self.reference_dict = self._load_reference_cache()
+        if self.reference_dict is None:
+            reference = SqFtProFormaReference(**self.__dict__)
+            self.reference_dict = reference.reference_dict
+            self._save_reference_cache()
+
+        # results of incremental lookups, keyed by form
+        self._lookup_cache = {}
 
     def check_is_reasonable(self):
+        assert np.dtype(self.dtype).kind == 'f'
         fars = pd.Series(self.fars)
         assert len(fars[fars > 20]) == 0
         assert len(fars[fars <= 0]) == 0
@@ -280,8 +333,107 @@ class SqFtProForma(object):
             np.array([self.construction_months[use] for use in self.uses])
         )
 
+    def __getstate__(self):
+        # the incremental lookup results are not needed by worker processes
+        state = self.__dict__.copy()
+        state['_lookup_cache'] = {}
+        return state
+
+    @property
+    def reference_hash(self):
+        """
+        Hash of the configuration returned by to_dict, which identifies the
+        reference tables in the cache.
+
+        """
+        # numpy arrays and scalars in the configuration hash as the lists
+        # and numbers they hold
+        config = json.dumps([REFERENCE_CACHE_VERSION, developer.__version__,
+                             self.to_dict], sort_keys=True,
+                            default=lambda o: np.asarray(o).tolist())
+        return hashlib.sha1(config.encode('utf-8')).hexdigest()
+
+    @property
+    def reference_cache_path(self):
+        """
+        Path of the file caching the reference tables, None if no
+        cache_dir was passed.
+
+        """
+        if self.cache_dir is None:
+            return None
+        return os.path.join(self.cache_dir,
+                            'reference_{}.npz'.format(self.reference_hash))
+
+    def _load_reference_cache(self):
+        """
+        Load the reference tables from the cache.
+
+        Returns
+        -------
+        reference_dict : dict or None
+            None if there is no cache or no usable file for this
+            configuration, in which case the tables have to be generated.
+        """
+        path = self.reference_cache_path
+        if path is None or not os.path.exists(path):
+            return None
+
+        try:
+            with np.load(path, allow_pickle=False) as cached:
+                if str(cached['hash']) != self.reference_hash:
+                    return None
+                index = pd.Index(cached['index'])
+                columns = cached['columns'].tolist()
+                reference_dict = {}
+                for i, (form, parking_config) in enumerate(
+                        cached['keys'].tolist()):
+                    reference_dict[(form, parking_config)] = pd.DataFrame(
+                        cached['table_{}'.format(i)], index=index,
+                        columns=columns)
+        except Exception:
+            logger.warning('could not read reference cache %s', path,
+                           exc_info=True)
+            return None
+
+        logger.debug('loaded SqftProForma reference tables from %s', path)
+        return reference_dict
+
+    def _save_reference_cache(self):
+        """
+        Save the reference tables to the cache, if there is one.  The file
+        is written under a temporary name and then moved into place so that
+        processes reading the cache never see a partial file.
+
+        """
+        path = self.reference_cache_path
+        if path is None:
+            return
+
+        keys = sorted(self.reference_dict.keys())
+        first = self.reference_dict[keys[0]]
+        arrays = {'table_{}'.format(i): self.reference_dict[key].values
+                  for i, key in enumerate(keys)}
+
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir,
+                                            suffix='.npz.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, hash=np.array(self.reference_hash),
+                         keys=np.array(keys), index=first.index.values,
+                         columns=np.array(first.columns.tolist()), **arrays)
+            _replace_file(tmp_path, path)
+        except (IOError, OSError):
+            logger.warning('could not write reference cache %s', path,
+                           exc_info=True)
+            return
+
+        logger.debug('saved SqftProForma reference tables to %s', path)
+
     @classmethod
-    def from_yaml(cls, yaml_str=None, str_or_buffer=None):
+    def from_yaml(cls, yaml_str=None, str_or_buffer=None, cache_dir=None):
         """
         Create a SqftProForma instance from a saved YAML configuration.
         Arguments are mutally exclusive.
@@ -292,6 +444,8 @@ class SqFtProForma(object):
             A YAML string from which to load model.
         str_or_buffer : str or file like, optional
             File name or buffer from which to load YAML.
+        cache_dir : str, optional
+            Directory in which to cache the reference tables.
 
         Returns
         -------
@@ -320,7 +474,9 @@ class SqFtProForma(object):
             cfg.get('only_built', True),
             cfg.get('pass_through', None),
             cfg.get('simple_zoning', False),
-            cfg.get('parcel_filter', None)
+            cfg.get('parcel_filter', None),
+            cfg.get('dtype', 'float64'),
+            cache_dir
         )
 
         logger.debug('loaded SqftProForma model from YAML')
@@ -381,14 +537,20 @@ class SqFtProForma(object):
                 'loan_to_cost_ratio': .7,
                 'drawdown_factor': .6,
                 'interest_rate': .05,
-                'loan_fees': .02
+                'loan_fees': .02,
+                'dtype': 'float64'
                 }
 
     @classmethod
-    def from_defaults(cls):
+    def from_defaults(cls, cache_dir=None):
         """
         Create a SqftProForma instance from default values.
 
+        Parameters
+        ----------
+        cache_dir : str, optional
+            Directory in which to cache the reference tables.
+
         Returns
         -------
         SqFtProForma
@@ -396,7 +558,7 @@ class SqFtProForma(object):
         """
 
         defaults = SqFtProForma.get_defaults()
-        model = cls(**defaults)
+        model = cls(cache_dir=cache_dir, **defaults)
         logger.debug('loaded SqftProForma model from default values')
         return model
 
@@ -416,7 +578,8 @@ class SqFtProForma(object):
                        'residential_to_yearly', 'parcel_filter', 'only_built',
                        'forms_to_test', 'pass_through', 'simple_zoning',
                        'construction_sqft_for_months', 'loan_to_cost_ratio',
-                       'drawdown_factor', 'interest_rate', 'loan_fees']
+                       'drawdown_factor', 'interest_rate', 'loan_fees',
+                       'dtype']
 
         results = {}
         for attribute in unconverted:
@@ -480,7 +643,9 @@ class SqFtProForma(object):
         return utils.convert_to_yaml(self.to_dict, str_or_buffer)
 
     def lookup(self, form, df, modify_df=None, modify_revenues=None,
-               modify_costs=None, modify_profits=None, **kwargs):
+               modify_costs=None, modify_profits=None, chunksize=None,
+               n_jobs=None, solver='grid', incremental=False,
+               adjustments=None, **kwargs):
         """
         This function does the developer model lookups for all the actual input
         data.
@@ -491,7 +656,11 @@ class SqFtProForma(object):
             One of the forms specified in the configuration file
         df : DataFrame
             Pass in a single data frame which is indexed by parcel_id and has
-            the following columns
+            the following columns.  The columns can also be passed as a dict
+            of arrays, a structured array or a pyarrow Table (see
+            ParcelColumns), which are indexed by their parcel_id column if
+            they have one.  Without callbacks the parcels are read column by
+            column and never copied.
         modify_df : function
             Function to modify lookup DataFrame before profit calculations.
             Must have (self, form, df) as parameters.
@@ -504,6 +673,62 @@ class SqFtProForma(object):
         modify_profits : function
             Function to modify profit ndarray during profit calculations.
             Must have (self, form, df, profits) as parameters.
+        chunksize : int, optional
+            If passed, parcels are processed in blocks of this many rows so
+            that peak memory is bounded by the chunk size rather than the
+            number of parcels.  The result is the same as without chunking.
+            Callbacks are called once per chunk.
+        n_jobs : int, optional
+            If greater than 1, parcels are split into shards (of chunksize
+            rows if passed, otherwise one per job) which are evaluated by a
+            pool of this many processes, or one per CPU if -1.  The parcel
+            columns are shared with the workers through shared memory and
+            the results are identical to the serial ones.  Callbacks must be
+            picklable in this case, and Python 3.8 or later is needed.
+        solver : str, optional
+            How the most profitable FAR is found for each parcel.  'grid'
+            (the default) evaluates profit at every FAR for every parcel.
+            'breakpoints' relies on profit being linear in FAR as long as
+            the cost per sqft, parking ratio and construction time do not
+            change (i.e. between the breakpoints of heights_for_costs and
+            construction_sqft_for_months), so only the first and the last
+            FAR allowed by zoning within each of these ranges are evaluated.
+            It gives the same results with less work.  'sparse' only
+            evaluates the FARs allowed by zoning, packed into flat arrays,
+            which saves the most work where zoning caps most parcels well
+            below the largest FAR tested, and also gives the same results.
+            'fused' finds the best FAR of each parcel in a single compiled
+            loop without any (fars x parcels) temporaries; it needs numba
+            and falls back to 'grid' when numba is not installed.  The
+            callbacks can make profit non-linear and expect (fars x
+            parcels) arrays, so passing modify_revenues, modify_costs or
+            modify_profits always uses the 'grid' solver.
+        incremental : bool, optional
+            If True, the result is kept along with a fingerprint of the
+            input columns of each parcel (the rents, land_cost,
+            parcel_size, max_far, max_height, max_dua, ave_unit_size and
+            pass_through columns), and the next incremental lookup of this
+            form only evaluates the parcels which are new or whose
+            fingerprint changed, reusing the kept result for the others.
+            This is meant for multi-year simulations in which few parcels
+            change from one year to the next.  Changing the configuration
+            or the set of input columns starts over from scratch, and
+            callbacks cannot be passed since their effect cannot be
+            fingerprinted.  See also clear_lookup_cache().
+        adjustments : dict, optional
+            Declarative alternative to modify_revenues, modify_costs and
+            modify_profits, which unlike the callbacks works with every
+            solver, chunksize, n_jobs and incremental lookups.  Keys are
+            forms and values dicts from the names in ADJUSTMENTS
+            (revenue_factor, revenue_offset, cost_factor, cost_offset,
+            profit_factor and profit_offset) to a scalar, the name of a
+            parcel column, or an array (or a Series indexed by parcel) with
+            one value per parcel.  Building revenue becomes
+            revenue * revenue_factor + revenue_offset, total development
+            cost cost * cost_factor + cost_offset, and profit, which is
+            computed from the adjusted revenue and cost,
+            profit * profit_factor + profit_offset.  Adjustments are applied
+            before the callbacks, if any.
 
         Input Dataframe Columns
         rent : dataframe
@@ -560,25 +785,842 @@ class SqFtProForma(object):
             max_far and max_height from the input dataframe).
         """
 
-        if self.simple_zoning:
+        hooks = (modify_df, modify_revenues, modify_costs, modify_profits)
+        self._check_solver(solver)
+        df = self._check_parcels(df, hooks)
+        df = self._check_adjustments(adjustments, df, hooks)
+
+        with utils.span('lookup'):
+            return self._lookup_dispatch(
+                form, df, modify_df, modify_revenues, modify_costs,
+                modify_profits, chunksize, n_jobs, solver, incremental)
+
+    def _lookup_dispatch(self, form, df, modify_df, modify_revenues,
+                         modify_costs, modify_profits, chunksize, n_jobs,
+                         solver, incremental):
+        """
+        Helper method to lookup(), which runs it with the arguments described
+        there.
+
+        """
+        if incremental:
+            self._check_incremental_hooks(modify_df, modify_revenues,
+                                          modify_costs, modify_profits)
+            return self._lookup_incremental([form], df, chunksize, n_jobs,
+                                            solver)[form]
+
+        if n_jobs is not None and n_jobs != 1 and len(df) > 0:
+            return self._lookup_parallel(
+                [form], df, n_jobs, chunksize, False,
+                (modify_df, modify_revenues, modify_costs, modify_profits),
+                solver)[form]
+
+        if chunksize is not None:
+            return self._concat_chunks(self.iter_lookup(
+                form, df, chunksize, modify_df, modify_revenues,
+                modify_costs, modify_profits, solver))
+
+        if self.simple_zoning and (modify_df or modify_revenues or
+                                   modify_costs or modify_profits):
+            df = self._simple_zoning(form, df)
+
+        return self._lookup(form, df, modify_df, modify_revenues,
+                            modify_costs, modify_profits, solver)
+
+    def iter_lookup(self, form, df, chunksize, modify_df=None,
+                    modify_revenues=None, modify_costs=None,
+                    modify_profits=None, solver='grid', adjustments=None):
+        """
+        Generator version of lookup() that processes parcels in blocks of
+        chunksize rows and yields the result for each block, so that regions
+        which do not fit in memory can be streamed.
+
+        Parameters
+        ----------
+        form : string
+            One of the forms specified in the configuration file
+        df : DataFrame or columns
+            Parcels, with the columns described in lookup()
+        chunksize : int
+            Number of parcels to process at a time
+        modify_df, modify_revenues, modify_costs, modify_profits : function
+            Callbacks as described in lookup(), called once per chunk
+        solver : str, optional
+            'grid', 'breakpoints', 'sparse' or 'fused', as described in
+            lookup()
+        adjustments : dict, optional
+            Revenue, cost and profit adjustments, as described in lookup()
+
+        Yields
+        ------
+        result : DataFrame
+            The lookup() result for the parcels in the chunk, which is
+            empty if none of them are feasible
+        """
+        if chunksize < 1:
+            raise ValueError('chunksize must be a positive integer')
+        hooks = (modify_df, modify_revenues, modify_costs, modify_profits)
+        self._check_solver(solver)
+        df = self._check_parcels(df, hooks)
+        df = self._check_adjustments(adjustments, df, hooks)
+
+        if self.simple_zoning and (modify_df or modify_revenues or
+                                   modify_costs or modify_profits):
             df = self._simple_zoning(form, df)
 
-        lookup = pd.concat(
-            self._lookup_parking_cfg(form, parking_config, df, modify_df,
-                                     modify_revenues, modify_costs,
-                                     modify_profits)
-            for parking_config in self.parking_configs)
+        for start in range(0, len(df), chunksize):
+            yield self._lookup(form, df.iloc[start:start + chunksize],
+                               modify_df, modify_revenues, modify_costs,
+                               modify_profits, solver)
+
+    def clear_lookup_cache(self):
+        """
+        Forget the results kept by incremental lookups, so that the next
+        incremental lookup evaluates every parcel.
+
+        """
+        self._lookup_cache = {}
+
+    def _incremental_columns(self, df):
+        """
+        The input columns which determine the lookup result of a parcel.
+
+        """
+        columns = self.uses + ['land_cost', 'parcel_size', 'max_far',
+                               'max_height', 'max_dua', 'ave_unit_size']
+        columns += [col for col in self.pass_through if col not in columns]
+        columns += sorted(col for col in df.columns
+                          if str(col).startswith(_ADJUSTMENT_PREFIX))
+        return [col for col in columns if col in df.columns]
+
+    @staticmethod
+    def _check_incremental_hooks(*hooks):
+        if any(hooks):
+            raise ValueError('callbacks cannot be used with incremental '
+                             'lookups')
+
+    def _lookup_incremental(self, forms, df, chunksize, n_jobs, solver):
+        """
+        Lookup several forms, only evaluating the parcels whose inputs
+        changed since the previous incremental lookup of each form.
+
+        Parameters
+        ----------
+        forms : list of strings
+            Names of forms
+        df : DataFrame
+            DataFrame of developable sites/parcels
+        chunksize, n_jobs, solver
+            As described in lookup()
+
+        Returns
+        -------
+        d : dict
+            Keys are forms and values the DataFrames returned by lookup()
+        """
+        columns = self._incremental_columns(df)
+        key = (self.reference_hash, tuple(columns))
+        values = (df[columns] if isinstance(df, pd.DataFrame)
+                  else df.to_frame(columns))
+        fingerprints = pd.util.hash_pandas_object(values, index=False)
+
+        unchanged = {}
+        changed = np.zeros(len(df), dtype='bool')
+        for form in forms:
+            cached = self._lookup_cache.get(form)
+            if cached is None or cached[0] != key:
+                same = np.zeros(len(df), dtype='bool')
+            else:
+                previous = cached[1]
+                positions = previous.index.get_indexer(df.index)
+                same = ((positions >= 0) &
+                        (previous.values[positions] == fingerprints.values))
+            unchanged[form] = same
+            changed |= ~same
+
+        logger.debug('incremental lookup of {} out of {} parcels'.format(
+            changed.sum(), len(df)))
+        hooks = (None, None, None, None)
+        d = self._lookup_all(forms, df.iloc[changed], hooks, chunksize,
+                             n_jobs, solver)
+
+        for form in forms:
+            # parcels changed for any form were evaluated again above, so
+            # only the parcels unchanged for every form are kept
+            kept = []
+            keep = unchanged[form] & ~changed
+            if keep.any():
+                result = self._lookup_cache[form][2]
+                kept = [result[result.index.isin(df.index[keep])]]
+            d[form] = self._concat_chunks(kept + [d[form]])
+            self._lookup_cache[form] = (
+                key, pd.Series(fingerprints.values, index=df.index), d[form])
+
+        return d
+
+    @staticmethod
+    def _check_parcels(df, hooks):
+        """
+        Wrap parcels which are not a DataFrame as ParcelColumns, which the
+        callbacks cannot be used with.
+
+        """
+        if isinstance(df, pd.DataFrame):
+            return df
+        if any(hooks):
+            raise ValueError('callbacks can only be used when the parcels '
+                             'are a DataFrame')
+        return df if isinstance(df, ParcelColumns) else ParcelColumns(df)
+
+    def _check_adjustments(self, adjustments, df, hooks):
+        """
+        Add the adjustments passed to lookup() to the parcels as columns,
+        one per form and adjustment, so that they follow the parcels
+        through chunks, worker processes and incremental lookups.  The
+        columns are read back by _adjustment_arrays().
+
+        """
+        if not adjustments:
+            return df
+
+        values = {}
+        for form, spec in adjustments.items():
+            if form not in self.forms:
+                raise ValueError('adjustments for unknown form {!r}'.format(
+                    form))
+            for name, value in spec.items():
+                if name not in ADJUSTMENTS:
+                    raise ValueError(
+                        'unknown adjustment {!r}, expected one of {}'.format(
+                            name, ', '.join(ADJUSTMENTS)))
+                if isinstance(value, str):
+                    value = df[value]
+                if isinstance(value, pd.Series):
+                    value = value.reindex(df.index)
+                value = np.asarray(value, dtype='float64')
+                if value.ndim == 0:
+                    value = np.full(len(df), value)
+                elif value.shape != (len(df),):
+                    raise ValueError(
+                        'adjustment {} of {} has {} values for {} '
+                        'parcels'.format(name, form, len(value), len(df)))
+                values[_ADJUSTMENT_PREFIX + form + '.' + name] = value
+
+        if any(hooks):
+            # the callbacks need a DataFrame, which is copied anyway
+            return df.assign(**values)
+        return ParcelColumns(df).with_columns(values)
+
+    def _adjustment_arrays(self, form, parcels):
+        """
+        The adjustments of a form added by _check_adjustments(), as a dict
+        of arrays keyed by the names in ADJUSTMENTS.
+
+        """
+        arrs = {}
+        for name in ADJUSTMENTS:
+            col = _ADJUSTMENT_PREFIX + form + '.' + name
+            if col in parcels:
+                arrs[name] = self._as_dtype(parcels[col])
+        return arrs
+
+    @staticmethod
+    def _check_solver(solver):
+        if solver not in ('grid', 'breakpoints', 'sparse', 'fused'):
+            raise ValueError("solver must be 'grid', 'breakpoints', "
+                             "'sparse' or 'fused', not {!r}".format(solver))
+
+    @staticmethod
+    def _concat_chunks(chunks):
+        """
+        Combine lookup results computed for blocks of parcels into the
+        result a single lookup would have returned.
+
+        Parameters
+        ----------
+        chunks : iterable of DataFrames
+            Results for each block of parcels
+
+        Returns
+        -------
+        result : DataFrame
+        """
+        chunks = [chunk for chunk in chunks if len(chunk) > 0]
+        if len(chunks) == 0:
+            return pd.DataFrame()
+        if len(chunks) == 1:
+            return chunks[0]
+        return pd.concat(chunks).sort_index()
+
+    def _lookup(self, form, df, modify_df, modify_revenues, modify_costs,
+                modify_profits, solver='grid'):
+        """
+        Run the lookup for one form.  With callbacks the parcels are a
+        DataFrame which already has any simple zoning applied, otherwise
+        they are read as ParcelColumns so that they are not copied.
+
+        Parameters
+        ----------
+        form : str
+            Name of form
+        df : DataFrame or ParcelColumns
+            Parcels passed to lookup() method
+        modify_df, modify_revenues, modify_costs, modify_profits : function
+            Callbacks as described in lookup()
+        solver : str, optional
+            'grid', 'breakpoints', 'sparse' or 'fused', as described in
+            lookup()
+
+        Returns
+        -------
+        result : DataFrame
+        """
+        if modify_df or modify_revenues or modify_costs or modify_profits:
+            lookup = pd.concat(
+                self._lookup_parking_cfg(form, parking_config, df, modify_df,
+                                         modify_revenues, modify_costs,
+                                         modify_profits, solver)
+                for parking_config in self.parking_configs)
+        else:
+            with utils.span('lookup.min_max_fars'):
+                context = self._parcel_context(form, ParcelColumns(df))
+                # only the evaluated parcels are taken, once for all parking
+                # configurations
+                context = context.iloc[np.flatnonzero(context['evaluated'])]
+            lookup = pd.concat(
+                self._lookup_parking_cfg_columns(form, parking_config,
+                                                 context, solver)
+                for parking_config in self.parking_configs)
 
         if len(lookup) == 0:
             return pd.DataFrame()
 
-        result = self._max_profit_parking(lookup)
+        with utils.span('lookup.max_profit_parking'):
+            result = self._max_profit_parking(lookup)
 
         if self.residential_to_yearly and "residential" in self.pass_through:
             result["residential"] /= self.cap_rate
 
         return result
 
+    def lookup_all(self, df, forms=None, modify_df=None,
+                   modify_revenues=None, modify_costs=None,
+                   modify_profits=None, chunksize=None, n_jobs=None,
+                   solver='grid', incremental=False, adjustments=None):
+        """
+        Does the developer model lookups for several forms at once and
+        returns the feasibility table expected by the Developer.
+
+        All forms and parking configurations are evaluated in a single pass
+        over a stacked (forms x parking configs x fars x parcels) array, so
+        the zoning filters and land costs are shared between forms.  The
+        callbacks are defined per form and parking configuration, so passing
+        any of them falls back to calling lookup() once per form.  Memory
+        use is the number of forms times the number of parking
+        configurations larger than for lookup(), so large regions should be
+        processed with chunksize.
+
+        Parameters
+        ----------
+        df : DataFrame
+            Pass in a single data frame which is indexed by parcel_id and has
+            the columns described in lookup(), or the columns as described
+            there
+        forms : list of strings, optional
+            The forms to test - if not passed, forms_to_test is used
+        modify_df, modify_revenues, modify_costs, modify_profits : function
+            Callbacks as described in lookup()
+        chunksize : int, optional
+            If passed, parcels are processed in blocks of this many rows, as
+            described in lookup()
+        n_jobs : int, optional
+            If greater than 1, parcel shards are evaluated for all forms by a
+            pool of this many processes, as described in lookup()
+        solver : str, optional
+            'grid', 'breakpoints', 'sparse' or 'fused', as described in
+            lookup().
+            The stacked evaluation of all forms is only used by the 'grid'
+            solver.
+        incremental : bool, optional
+            If True, only evaluate the parcels whose inputs changed since
+            the previous incremental lookup of each form, as described in
+            lookup()
+        adjustments : dict, optional
+            Revenue, cost and profit adjustments keyed by form, as
+            described in lookup()
+
+        Returns
+        -------
+        feasibility : DataFrame
+            DataFrame with hierarchical columns, where the first level is the
+            form and the second level the columns returned by lookup().
+            Forms for which no parcel is feasible are left out, as when
+            concatenating the results of lookup().
+        """
+        forms = self.forms_to_test if forms is None else forms
+        hooks = (modify_df, modify_revenues, modify_costs, modify_profits)
+        self._check_solver(solver)
+        df = self._check_parcels(df, hooks)
+        df = self._check_adjustments(adjustments, df, hooks)
+
+        with utils.span('lookup_all'):
+            if incremental:
+                self._check_incremental_hooks(*hooks)
+                d = self._lookup_incremental(forms, df, chunksize, n_jobs,
+                                             solver)
+            else:
+                d = self._lookup_all(forms, df, hooks, chunksize, n_jobs,
+                                     solver)
+
+            return pd.concat([d[form] for form in forms], keys=forms,
+                             axis=1)
+
+    def lookup_to_parquet(self, path, df, forms=None, **kwargs):
+        """
+        Run lookup_all() and write the feasibility table to a Parquet file,
+        which Developer.from_parquet() reads back.  This requires pyarrow.
+
+        Parameters
+        ----------
+        path : str or file like
+            Where to write the file
+        df : DataFrame or columns
+            Parcels, as described in lookup_all()
+        forms : list of strings, optional
+            The forms to test - if not passed, forms_to_test is used
+        kwargs
+            Other arguments of lookup_all(), e.g. chunksize or n_jobs
+
+        Returns
+        -------
+        feasibility : DataFrame
+            The table returned by lookup_all()
+        """
+        feasibility = self.lookup_all(df, forms, **kwargs)
+        with utils.span('lookup_to_parquet'):
+            utils.to_parquet(feasibility, path)
+        return feasibility
+
+    def _lookup_all(self, forms, df, hooks, chunksize, n_jobs, solver):
+        """
+        Lookup several forms, with the arguments described in lookup_all().
+
+        Returns
+        -------
+        d : dict
+            Keys are forms and values the DataFrames returned by lookup()
+        """
+        if n_jobs is not None and n_jobs != 1 and len(df) > 0:
+            return self._lookup_parallel(forms, df, n_jobs, chunksize, True,
+                                         hooks, solver)
+
+        if chunksize is None:
+            chunks = [df]
+        elif chunksize < 1:
+            raise ValueError('chunksize must be a positive integer')
+        else:
+            chunks = (df.iloc[start:start + chunksize]
+                      for start in range(0, len(df), chunksize))
+
+        parts = {form: [] for form in forms}
+        for chunk in chunks:
+            d = self._lookup_chunk(forms, chunk, hooks, solver)
+            for form in forms:
+                parts[form].append(d[form])
+
+        return {form: self._concat_chunks(parts[form]) for form in forms}
+
+    def _lookup_chunk(self, forms, df, hooks, solver):
+        """
+        Lookup several forms for one block of parcels, using the stacked
+        evaluation unless callbacks or another solver are passed.
+
+        Parameters
+        ----------
+        forms : list of strings
+            Names of forms
+        df : DataFrame
+            DataFrame of developable sites/parcels
+        hooks : tuple
+            The modify_df, modify_revenues, modify_costs and modify_profits
+            callbacks
+        solver : str
+            'grid', 'breakpoints', 'sparse' or 'fused', as described in
+            lookup()
+
+        Returns
+        -------
+        d : dict
+            Keys are forms and values the DataFrames returned by lookup()
+        """
+        if any(hooks) or solver != 'grid':
+            d = {}
+            for form in forms:
+                d[form] = self.lookup(form, df.copy() if any(hooks) else df,
+                                      *hooks, solver=solver)
+            return d
+        return self._lookup_forms(forms, df)
+
+    def _lookup_parallel(self, forms, df, n_jobs, chunksize, batched, hooks,
+                         solver):
+        """
+        Evaluate parcel shards in a pool of processes.  Numeric columns are
+        copied once into shared memory and the pro forma is sent once to
+        each worker, so only shard boundaries and results are passed
+        between processes.
+
+        Parameters
+        ----------
+        forms : list of strings
+            Names of forms
+        df : DataFrame
+            DataFrame of developable sites/parcels
+        n_jobs : int
+            Number of processes, or -1 for one per CPU
+        chunksize : int or None
+            Number of parcels per shard, by default one shard per process
+        batched : bool
+            Whether workers use lookup_all() (True) or lookup() (False)
+        hooks : tuple
+            The modify_df, modify_revenues, modify_costs and modify_profits
+            callbacks
+        solver : str
+            'grid', 'breakpoints', 'sparse' or 'fused', as described in
+            lookup()
+
+        Returns
+        -------
+        d : dict
+            Keys are forms and values the DataFrames returned by lookup()
+        """
+        try:
+            from multiprocessing import shared_memory
+        except ImportError:
+            raise ImportError('n_jobs greater than 1 needs Python 3.8 or '
+                              'later, for multiprocessing.shared_memory')
+        from concurrent.futures import ProcessPoolExecutor
+        from multiprocessing import cpu_count
+
+        if n_jobs < 0:
+            n_jobs = cpu_count()
+        if chunksize is None:
+            chunksize = int(np.ceil(len(df) / float(n_jobs)))
+        elif chunksize < 1:
+            raise ValueError('chunksize must be a positive integer')
+
+        parcels = ParcelColumns(df)
+        blocks = []
+        shared = []
+        other = {}
+        try:
+            for name in parcels.columns:
+                values = parcels[name]
+                if (isinstance(values, np.ndarray) and
+                        values.dtype.kind in 'biufc'):
+                    shm = shared_memory.SharedMemory(create=True,
+                                                     size=values.nbytes)
+                    blocks.append(shm)
+                    np.ndarray(values.shape, dtype=values.dtype,
+                               buffer=shm.buf)[:] = values
+                    shared.append((name, shm.name, values.dtype.str))
+                else:
+                    other[name] = values
+
+            initargs = (self, parcels.index, parcels.columns, shared, other,
+                        hooks)
+            with ProcessPoolExecutor(n_jobs, initializer=_init_lookup_worker,
+                                     initargs=initargs) as pool:
+                futures = [pool.submit(_lookup_shard, forms, start,
+                                       start + chunksize, batched, solver)
+                           for start in range(0, len(df), chunksize)]
+                results = [future.result() for future in futures]
+        finally:
+            for shm in blocks:
+                shm.close()
+                shm.unlink()
+
+        return {form: self._concat_chunks(result[form] for result in results)
+                for form in forms}
+
+    def _lookup_forms(self, forms, df):
+        """
+        Vectorized lookup of several forms and all parking configurations,
+        used by lookup_all().
+
+        Parameters
+        ----------
+        forms : list of strings
+            Names of forms
+        df : DataFrame or ParcelColumns
+            Parcels passed to lookup_all(), which are read as ParcelColumns
+
+        Returns
+        -------
+        d : dict
+            Keys are forms and values the DataFrames returned by lookup()
+        """
+        with utils.span('lookup_all.prepare'):
+            parcels = ParcelColumns(df)
+            rents = np.column_stack([parcels[use] for use in self.uses])
+
+            # Zoning is the same for all forms unless simple_zoning is set, in
+            # which case residential and other forms see different columns
+            zoned = {}
+            min_max_fars = {}
+            max_heights = []
+            weighted_rents = []
+            caps = []
+            for form in forms:
+                zkey = self.simple_zoning and form == "residential"
+                if zkey not in zoned:
+                    zoned[zkey] = (self._simple_zoning_columns(form, parcels)
+                                   if self.simple_zoning else parcels)
+                zoned_parcels = zoned[zkey]
+
+                resratio = self.res_ratios[form]
+                if (zkey, resratio) not in min_max_fars:
+                    min_max_fars[(zkey, resratio)] = self._min_max_fars_array(
+                        zoned_parcels, resratio)
+                caps.append(min_max_fars[(zkey, resratio)])
+                max_heights.append(zoned_parcels['max_height'])
+                weighted_rents.append(np.dot(rents, self.forms[form]))
+
+            # (forms, 1, 1, parcels) arrays of parcel values
+            def stack_parcels(arrs):
+                return np.array(arrs, dtype=self.dtype)[:, None, None, :]
+
+            caps = stack_parcels(caps)
+            max_heights = stack_parcels(max_heights)
+            weighted_rents = stack_parcels(weighted_rents)
+
+            # (forms, parking configs, fars, 1) arrays of reference values
+            dev_infos = [[self.reference_dict[(form, parking_config)]
+                          for parking_config in self.parking_configs]
+                         for form in forms]
+
+            def stack_reference(col):
+                return np.array([[dev_info[col].values for dev_info in row]
+                                 for row in dev_infos],
+                                dtype=self.dtype)[..., None]
+
+            # (forms, 1, 1, parcels) arrays of adjustments, with defaults
+            # which leave the values unchanged for the forms without them
+            adjustments = {}
+            form_adjustments = [self._adjustment_arrays(form, parcels)
+                                for form in forms]
+            for name in ADJUSTMENTS:
+                if any(name in arrs for arrs in form_adjustments):
+                    default = np.full(len(parcels),
+                                      1. if name.endswith('factor') else 0.)
+                    adjustments[name] = stack_parcels(
+                        [arrs.get(name, default)
+                         for arrs in form_adjustments])
+
+            cost_sqft = stack_reference('ave_cost_sqft')
+            parking_sqft_ratio = stack_reference('parking_sqft_ratio')
+            heights = stack_reference('height')
+            months = stack_reference('construction_months')
+            far_col = columnize(self._as_dtype(dev_infos[0][0].index.values))
+
+        with utils.span('lookup_all.mask'):
+            # turn fars into nans where they are not allowed by zoning
+            mask = (far_col > caps + .01) | (heights > max_heights + .01)
+            fars = np.where(mask, np.nan, far_col)
+
+        with utils.span('lookup_all.profit'):
+            arrs = self._profit_arrays(fars,
+                                       self._as_dtype(parcels['parcel_size']),
+                                       self._as_dtype(parcels['land_cost']),
+                                       weighted_rents, cost_sqft,
+                                       parking_sqft_ratio, months,
+                                       adjustments=adjustments)
+
+            maxprofitind = np.argmax(arrs['profit'], axis=2)[:, :, None, :]
+
+            def take(arr):
+                return np.take_along_axis(
+                    arr, maxprofitind, axis=2)[:, :, 0, :].astype(self.dtype)
+
+            best = {name: take(arr) for name, arr in arrs.items()}
+            best['fars'] = take(fars)
+            best['heights'] = take(heights)
+            best['months'] = take(months)
+            best['parking_sqft_ratio'] = take(parking_sqft_ratio)
+
+        d = {}
+        for i, form in enumerate(forms):
+            keep = np.ones(len(parcels), dtype='bool')
+            if self.only_built:
+                with np.errstate(invalid='ignore'):
+                    keep = ((caps[i, 0, 0] > 0) &
+                            (parcels['parcel_size'] > 0))
+            index = parcels.index[keep]
+            pass_through = {col: parcels[col][keep]
+                            for col in self.pass_through}
+
+            with utils.span('lookup_all.frame'):
+                lookup = pd.concat(
+                    self._lookup_frame(form, parking_config,
+                                       {name: arr[i, j][keep]
+                                        for name, arr in best.items()},
+                                       index, pass_through)
+                    for j, parking_config in enumerate(self.parking_configs))
+
+            if len(lookup) == 0:
+                d[form] = pd.DataFrame()
+                continue
+
+            with utils.span('lookup.max_profit_parking'):
+                result = self._max_profit_parking(lookup)
+
+            if (self.residential_to_yearly and
+                    "residential" in self.pass_through):
+                result["residential"] /= self.cap_rate
+
+            d[form] = result
+
+        return d
+
+    def lookup_scenarios(self, form, df, scenarios, chunksize=None):
+        """
+        Lookup one form under several scenarios at once, e.g. for a
+        sensitivity analysis of rents or financing costs.  The zoning and
+        the other values that do not depend on the scenario are computed
+        once, and profit is evaluated for all scenarios in one pass over a
+        (scenarios x fars x parcels) array per parking configuration, so
+        large regions should be processed with chunksize.
+
+        Parameters
+        ----------
+        form : string
+            One of the forms specified in the configuration file
+        df : DataFrame or columns
+            Parcels, with the columns described in lookup()
+        scenarios : DataFrame or dict
+            One row per scenario, indexed by scenario name, with any of the
+            columns
+
+            rent_factor
+                Multiplies the rent of the form
+            cap_rate, interest_rate, loan_to_cost_ratio, drawdown_factor,
+            loan_fees
+                Replace the value of the pro forma (see FINANCE_PARAMETERS)
+            revenue_factor, revenue_offset, cost_factor, cost_offset,
+            profit_factor, profit_offset
+                Adjust revenue, cost and profit as described in lookup()
+        chunksize : int, optional
+            If passed, parcels are processed in blocks of this many rows
+
+        Returns
+        -------
+        result : DataFrame
+            The columns returned by lookup(), indexed by scenario and
+            parcel, with the scenarios in the order passed and the parcels
+            which are not feasible in a scenario left out
+        """
+        scenarios = pd.DataFrame(scenarios)
+        allowed = ('rent_factor',) + FINANCE_PARAMETERS + ADJUSTMENTS
+        unknown = [col for col in scenarios.columns if col not in allowed]
+        if unknown:
+            raise ValueError('unknown scenario parameters: {}'.format(
+                ', '.join(map(str, unknown))))
+        if not scenarios.index.is_unique:
+            raise ValueError('scenario names must be unique')
+        df = self._check_parcels(df, ())
+        if chunksize is None:
+            chunks = [df]
+        elif chunksize < 1:
+            raise ValueError('chunksize must be a positive integer')
+        else:
+            chunks = (df.iloc[start:start + chunksize]
+                      for start in range(0, len(df), chunksize))
+
+        with utils.span('lookup_scenarios'):
+            parts = [self._lookup_scenarios(form, ParcelColumns(chunk),
+                                            scenarios)
+                     for chunk in chunks]
+
+            names = []
+            results = []
+            for name in scenarios.index:
+                result = self._concat_chunks(part[name] for part in parts)
+                if len(result) > 0:
+                    names.append(name)
+                    results.append(result)
+            if len(results) == 0:
+                return pd.DataFrame()
+            return pd.concat(results, keys=names, names=['scenario'])
+
+    def _lookup_scenarios(self, form, parcels, scenarios):
+        """
+        Lookup one form under several scenarios for one block of parcels.
+
+        Parameters
+        ----------
+        form : str
+            Name of form
+        parcels : ParcelColumns
+            Parcels passed to lookup_scenarios()
+        scenarios : DataFrame
+            Scenarios passed to lookup_scenarios()
+
+        Returns
+        -------
+        d : dict
+            Keys are scenario names and values the DataFrames returned by
+            lookup() under that scenario
+        """
+        with utils.span('lookup.min_max_fars'):
+            context = self._parcel_context(form, parcels)
+            context = context.iloc[np.flatnonzero(context['evaluated'])]
+
+        # (scenarios, 1, 1) arrays which broadcast against (fars, parcels)
+        values = {col: self._as_dtype(scenarios[col].values)[:, None, None]
+                  for col in scenarios.columns}
+        weighted_rent = np.broadcast_to(
+            self._as_dtype(context['weighted_rent']),
+            (len(scenarios), 1, len(context)))
+        if 'rent_factor' in values:
+            weighted_rent = weighted_rent * values['rent_factor']
+        adjustments = {name: values[name] for name in ADJUSTMENTS
+                       if name in values}
+        params = {name: values[name] for name in FINANCE_PARAMETERS
+                  if name in values}
+
+        best = {}
+        for parking_config in self.parking_configs:
+            best[parking_config] = self._best_far(
+                form, parking_config, context['min_max_fars'],
+                context['max_height'], context['parcel_size'],
+                context['land_cost'], weighted_rent, adjustments=adjustments,
+                params=params)
+
+        d = {}
+        for i, name in enumerate(scenarios.index):
+            with utils.span('lookup.frame'):
+                lookup = pd.concat(
+                    self._lookup_frame(form, parking_config,
+                                       {col: arr[i] for col, arr in
+                                        best[parking_config].items()},
+                                       context.index, context)
+                    for parking_config in self.parking_configs)
+            if len(lookup) == 0:
+                d[name] = pd.DataFrame()
+                continue
+
+            with utils.span('lookup.max_profit_parking'):
+                result = self._max_profit_parking(lookup)
+
+            if (self.residential_to_yearly and
+                    "residential" in self.pass_through):
+                cap_rate = (scenarios['cap_rate'].iloc[i]
+                            if 'cap_rate' in scenarios else self.cap_rate)
+                result["residential"] /= cap_rate
+
+            d[name] = result
+
+        return d
+
     @staticmethod
     def _simple_zoning(form, df):
         """
@@ -607,11 +1649,36 @@ class SqFtProForma(object):
 
         return df
 
+    @staticmethod
+    def _simple_zoning_columns(form, parcels):
+        """
+        Version of _simple_zoning() for parcel columns, which returns the
+        parcels with the columns replaced instead of changing them.
+
+        Parameters
+        ----------
+        form : str
+            Name of form passed to lookup method
+        parcels : ParcelColumns
+            Parcels passed to lookup method
+
+        Returns
+        -------
+        parcels : ParcelColumns
+        """
+        nans = np.full(len(parcels), np.nan)
+        if form == "residential":
+            return parcels.with_columns({"max_far": nans,
+                                         "max_height": nans})
+        return parcels.with_columns({"max_dua": nans, "max_height": nans})
+
     @staticmethod
     def _max_profit_parking(df):
         """
         Return parcels DataFrame with parking configuration that maximizes
-        profit
+        profit.  The profits of all configurations are reduced with a single
+        argmax over a (parcels x parking configs) array and the winning rows
+        are gathered by position.
 
         Parameters
         ----------
@@ -623,22 +1690,31 @@ class SqFtProForma(object):
         result : DataFrame
         """
 
-        max_profit_ind = df.pivot(
-            columns="parking_config",
-            values="max_profit").idxmax(axis=1).to_frame("parking_config")
-
-        df.set_index(["parking_config"], append=True, inplace=True)
-        max_profit_ind.set_index(["parking_config"], append=True,
-                                 inplace=True)
-
-        # get the max_profit idx
-        result = df.loc[max_profit_ind.index].reset_index(1)
-
-        return result
+        # (parcels x parking configs) arrays of the profit and the row of df
+        # for each parcel and configuration, which are both sorted
+        parcels, parcel_ids = pd.factorize(df.index, sort=True)
+        configs, config_names = pd.factorize(df.parking_config.values,
+                                             sort=True)
+        rows = np.full((len(parcel_ids), len(config_names)), -1)
+        rows[parcels, configs] = np.arange(len(df))
+        profits = np.full(rows.shape, -np.inf)
+        profits[parcels, configs] = np.nan_to_num(
+            df.max_profit.values.astype('float64'), nan=-np.inf)
+
+        # ties go to the first configuration alphabetically, and parcels
+        # without a finite profit to their first configuration
+        best = profits.argmax(axis=1)
+        missing = rows[np.arange(len(rows)), best] < 0
+        best[missing] = (rows[missing] >= 0).argmax(axis=1)
+
+        result = df.iloc[rows[np.arange(len(rows)), best]]
+        columns = ["parking_config"] + [col for col in result.columns
+                                        if col != "parking_config"]
+        return result[columns]
 
     def _lookup_parking_cfg(self, form, parking_config, df,
                             modify_df, modify_revenues, modify_costs,
-                            modify_profits):
+                            modify_profits, solver='grid'):
         """
         This is the core square foot pro forma calculation. For each form and
         parking configuration, generate DataFrame with profitability
@@ -664,70 +1740,550 @@ class SqFtProForma(object):
         modify_profits : func
             Function to modify profit ndarray during profit calculations.
             Must have (self, form, df, profits) as parameters.
+        solver : str, optional
+            'grid', 'breakpoints', 'sparse' or 'fused', as described in
+            lookup()
 
         Returns
         -------
         outdf : DataFrame
         """
-        # don't really mean to edit the df that's passed in
-        df = df.copy()
+        with utils.span('lookup.copy'):
+            # don't really mean to edit the df that's passed in
+            df = df.copy()
+            df['weighted_rent'] = np.dot(df[self.uses], self.forms[form])
+
+            # Allow for user modification of DataFrame here
+            df = modify_df(self, form, df) if modify_df else df
+
+        with utils.span('lookup.min_max_fars'):
+            # ZONING FILTERS
+            # Minimize between max_fars and max_heights
+            df['max_far_from_heights'] = (df.max_height
+                                          / self.height_per_story
+                                          * self.parcel_coverage)
+
+            df['min_max_fars'] = self._min_max_fars(df, self.res_ratios[form])
+
+            if self.only_built:
+                df = df.query('min_max_fars > 0 and parcel_size > 0')
+
+        best = self._best_far(
+            form, parking_config, df.min_max_fars.values,
+            df.max_height.values, df.parcel_size.values, df.land_cost.values,
+            df.weighted_rent.values, solver, df, modify_revenues,
+            modify_costs, modify_profits,
+            self._adjustment_arrays(form, df))
+
+        with utils.span('lookup.frame'):
+            return self._lookup_frame(form, parking_config, best, df.index,
+                                      df)
+
+    def parcel_context(self, form, df):
+        """
+        The values used by lookup() which depend on the form but not on the
+        parking configuration, so they are computed once per form and
+        shared between parking configurations.  This shows the effective
+        FAR allowed on each parcel.
+
+        Parameters
+        ----------
+        form : string
+            One of the forms specified in the configuration file
+        df : DataFrame or columns
+            Parcels, with the columns described in lookup()
+
+        Returns
+        -------
+        context : DataFrame
+            Indexed like the parcels, with the columns
+
+            weighted_rent
+                Rent of the form, weighted by the uses it is made of
+            max_far_from_heights
+                FAR allowed by max_height
+            max_far_from_dua
+                FAR allowed by max_dua, only if max_dua is passed and the
+                form has residential space
+            min_max_fars
+                FAR allowed by zoning, the smallest of max_far and the
+                values above (after simple_zoning, if set)
+            evaluated
+                Whether the parcel is evaluated, which with only_built
+                requires a positive min_max_fars and parcel_size
+        """
+        parcels = ParcelColumns(self._check_parcels(df, ()))
+        context = self._parcel_context(form, parcels)
+        return context.to_frame([col for col in self._context_columns
+                                 if col in context])
+
+    _context_columns = ['weighted_rent', 'max_far_from_heights',
+                        'max_far_from_dua', 'min_max_fars', 'evaluated']
+
+    def _parcel_context(self, form, parcels):
+        """
+        Add the columns described in parcel_context() to the parcels.
+
+        Parameters
+        ----------
+        form : str
+            Name of form
+        parcels : ParcelColumns
+            Parcels passed to lookup()
+
+        Returns
+        -------
+        context : ParcelColumns
+            The parcels, with simple zoning applied if set, and the
+            context columns
+        """
+        if self.simple_zoning:
+            parcels = self._simple_zoning_columns(form, parcels)
+
+        values = self._far_limits(parcels, self.res_ratios[form])
+        values['min_max_fars'] = reduce(np.fmin, values.values())
+        del values['max_far']
+        values['weighted_rent'] = np.dot(
+            np.column_stack([parcels[use] for use in self.uses]),
+            self.forms[form])
 
+        evaluated = np.ones(len(parcels), dtype='bool')
+        if self.only_built:
+            with np.errstate(invalid='ignore'):
+                evaluated = ((values['min_max_fars'] > 0) &
+                             (parcels['parcel_size'] > 0))
+        values['evaluated'] = evaluated
+
+        return parcels.with_columns(values)
+
+    def _lookup_parking_cfg_columns(self, form, parking_config, context,
+                                    solver='grid'):
+        """
+        The pro forma calculation of _lookup_parking_cfg() without
+        callbacks, which reads the parcels as arrays, with the values
+        derived from them (weighted rent and FAR caps) computed once per
+        form by _parcel_context() rather than added to a copy of the
+        parcels.
+
+        Parameters
+        ----------
+        form : str
+            Name of form
+        parking_config : str
+            Name of parking configuration
+        context : ParcelColumns
+            The parcels to evaluate, with the columns added by
+            _parcel_context()
+        solver : str, optional
+            'grid', 'breakpoints', 'sparse' or 'fused', as described in
+            lookup()
+
+        Returns
+        -------
+        outdf : DataFrame
+        """
+        best = self._best_far(
+            form, parking_config, context['min_max_fars'],
+            context['max_height'], context['parcel_size'],
+            context['land_cost'], context['weighted_rent'], solver,
+            adjustments=self._adjustment_arrays(form, context))
+
+        with utils.span('lookup.frame'):
+            return self._lookup_frame(form, parking_config, best,
+                                      context.index, context)
+
+    def _best_far(self, form, parking_config, caps, max_heights,
+                  parcel_size, land_cost, weighted_rent, solver='grid',
+                  df=None, modify_revenues=None, modify_costs=None,
+                  modify_profits=None, adjustments=None, params=None):
+        """
+        Find the most profitable FAR allowed by zoning for each parcel.
+
+        Parameters
+        ----------
+        form : str
+            Name of form
+        parking_config : str
+            Name of parking configuration
+        caps, max_heights : ndarray
+            The FAR (min_max_fars) and height allowed by zoning
+        parcel_size, land_cost, weighted_rent : ndarray
+            Parcel values
+        solver : str, optional
+            'grid', 'breakpoints', 'sparse' or 'fused', as described in
+            lookup()
+        df : DataFrame, optional
+            Parcels passed to the callbacks
+        modify_revenues, modify_costs, modify_profits : func, optional
+            Callbacks as described in lookup()
+        adjustments : dict, optional
+            Arrays of parcel values keyed by the names in ADJUSTMENTS, as
+            returned by _adjustment_arrays()
+        params : dict, optional
+            Values of FINANCE_PARAMETERS, as described in _profit_arrays().
+            These and the other arguments can have leading (scenario) axes
+            before the (fars x parcels) axes, in which case only the 'grid'
+            solver is used.
+
+        Returns
+        -------
+        best : dict
+            1-D arrays with one value per parcel, as described in
+            _lookup_frame(), or arrays with the leading axes of the
+            arguments
+        """
         # Reference table for this form and parking configuration
         dev_info = self.reference_dict[(form, parking_config)]
 
+        hooks = modify_revenues or modify_costs or modify_profits
+        if params:
+            solver = 'grid'
+        if solver == 'sparse' and not hooks:
+            return self._best_far_sparse(dev_info, caps, max_heights,
+                                         parcel_size, land_cost,
+                                         weighted_rent, adjustments)
+        if solver == 'fused' and not hooks and _fused_kernel is not None:
+            return self._best_far_fused(dev_info, caps, max_heights,
+                                        parcel_size, land_cost,
+                                        weighted_rent, adjustments)
+
         # Helper values
-        cost_sqft_col = columnize(dev_info.ave_cost_sqft.values)
-        cost_sqft_index_col = columnize(dev_info.index.values)
-        parking_sqft_ratio = columnize(dev_info.parking_sqft_ratio.values)
-        heights = columnize(dev_info.height.values)
-        months = columnize(dev_info.construction_months.values)
-        resratio = self.res_ratios[form]
-        nonresratio = 1.0 - resratio
-        df['weighted_rent'] = np.dot(df[self.uses], self.forms[form])
+        cost_sqft_col = columnize(
+            self._as_dtype(dev_info.ave_cost_sqft.values))
+        cost_sqft_index_col = columnize(
+            self._as_dtype(dev_info.index.values))
+        parking_sqft_ratio = columnize(
+            self._as_dtype(dev_info.parking_sqft_ratio.values))
+        heights = columnize(self._as_dtype(dev_info.height.values))
+        months = columnize(
+            self._as_dtype(dev_info.construction_months.values))
+
+        with utils.span('lookup.mask'):
+            rows = None
+            if solver == 'breakpoints' and not hooks:
+                rows = self._breakpoint_rows(dev_info, caps, max_heights)
+
+            if rows is not None:
+                # only evaluate the candidate FARs, which are all allowed by
+                # zoning unless marked as invalid
+                rows, valid = rows
+                fars = np.where(valid, cost_sqft_index_col[rows, 0], np.nan)
+                cost_sqft_col = cost_sqft_col[rows, 0]
+                parking_sqft_ratio = parking_sqft_ratio[rows, 0]
+                heights = heights[rows, 0]
+                months = months[rows, 0]
+            else:
+                # turn fars and heights into nans which are not allowed by
+                # zoning (so we can fillna with one of the other zoning
+                # constraints)
+                fars = np.repeat(cost_sqft_index_col, len(caps), axis=1)
+                # mask out existing nans for safer comparison
+                mask = ~np.isnan(fars)
+                mask *= (np.nan_to_num(fars) > self._as_dtype(caps) + .01)
+                fars[mask] = np.nan
+
+                mask = ~np.isnan(heights)
+                mask = mask * (np.nan_to_num(heights) >
+                               self._as_dtype(max_heights) + .01)
+                fars[mask] = np.nan
+
+        with utils.span('lookup.profit'):
+            # PROFIT CALCULATION
+            arrs = self._profit_arrays(
+                fars, self._as_dtype(parcel_size),
+                self._as_dtype(land_cost), self._as_dtype(weighted_rent),
+                cost_sqft_col, parking_sqft_ratio, months, form, df,
+                modify_revenues, modify_costs, modify_profits, adjustments,
+                params)
+
+            maxprofitind = np.argmax(arrs['profit'], axis=-2)
+
+            def twod_get(indexes, arr):
+                arr = np.broadcast_to(arr, arrs['profit'].shape)
+                return np.take_along_axis(
+                    arr, indexes[..., None, :],
+                    axis=-2)[..., 0, :].astype(self.dtype)
+
+            best = {name: twod_get(maxprofitind, arr)
+                    for name, arr in arrs.items()}
+            best['fars'] = twod_get(maxprofitind, fars)
+            best['heights'] = twod_get(maxprofitind, heights)
+            best['months'] = twod_get(maxprofitind, months)
+            best['parking_sqft_ratio'] = twod_get(maxprofitind,
+                                                  parking_sqft_ratio)
+
+        return best
+
+    def _best_far_sparse(self, dev_info, caps, max_heights, parcel_size,
+                         land_cost, weighted_rent, adjustments=None):
+        """
+        Version of _best_far() for the 'sparse' solver.  Only the (parcel,
+        FAR) pairs allowed by zoning are evaluated: they are compacted into
+        flat arrays sorted by parcel (like a CSR matrix with one row per
+        parcel) and the most profitable FAR of each parcel is found with a
+        segmented argmax.
 
-        # Allow for user modification of DataFrame here
-        df = modify_df(self, form, df) if modify_df else df
+        Parameters
+        ----------
+        dev_info : DataFrame
+            Reference table for a form and parking configuration
+        caps, max_heights, parcel_size, land_cost, weighted_rent : ndarray
+            As described in _best_far()
+        adjustments : dict, optional
+            As described in _best_far()
 
-        # ZONING FILTERS
-        # Minimize between max_fars and max_heights
-        df['max_far_from_heights'] = (df.max_height
-                                      / self.height_per_story
-                                      * self.parcel_coverage)
+        Returns
+        -------
+        best : dict
+            1-D arrays with one value per parcel, as described in
+            _lookup_frame(), with nans (and -inf profits) for parcels where
+            zoning does not allow any FAR
+        """
+        far_grid = self._as_dtype(dev_info.index.values)
+        cost_sqft = self._as_dtype(dev_info.ave_cost_sqft.values)
+        parking_sqft_ratio = self._as_dtype(
+            dev_info.parking_sqft_ratio.values)
+        heights = self._as_dtype(dev_info.height.values)
+        months = self._as_dtype(dev_info.construction_months.values)
+        size = len(caps)
+
+        with utils.span('lookup.mask'):
+            # the same zoning test as the 'grid' solver, with parcels along
+            # the first axis so that the pairs come out sorted by parcel
+            with np.errstate(invalid='ignore'):
+                allowed = ~(
+                    (far_grid > self._as_dtype(caps)[:, None] + .01) |
+                    (heights > self._as_dtype(max_heights)[:, None] + .01) |
+                    np.isnan(far_grid))
+            parcels, rows = np.nonzero(allowed)
+            del allowed
+            counts = np.bincount(parcels, minlength=size)
+            offsets = np.r_[0, np.cumsum(counts)]
+
+        with utils.span('lookup.profit'):
+            arrs = self._profit_arrays(
+                far_grid[rows], self._as_dtype(parcel_size)[parcels],
+                self._as_dtype(land_cost)[parcels],
+                self._as_dtype(weighted_rent)[parcels], cost_sqft[rows],
+                parking_sqft_ratio[rows], months[rows],
+                adjustments={name: arr[parcels] for name, arr in
+                             (adjustments or {}).items()})
+            arrs['fars'] = far_grid[rows]
+            arrs['heights'] = heights[rows]
+            arrs['months'] = months[rows]
+            arrs['parking_sqft_ratio'] = parking_sqft_ratio[rows]
+
+            # segmented argmax - the first maximum of each parcel, which is
+            # the smallest FAR as with np.argmax
+            profit = arrs['profit']
+            nonempty = counts > 0
+            segment_max = np.full(size, -np.inf, dtype=profit.dtype)
+            if len(profit) > 0:
+                segment_max[nonempty] = np.maximum.reduceat(
+                    profit, offsets[:-1][nonempty])
+            first = np.flatnonzero(profit == segment_max[parcels])
+            first = first[np.r_[True, parcels[first[1:]] !=
+                                parcels[first[:-1]]]]
+            best_parcels = parcels[first]
+
+            best = {}
+            for name, arr in arrs.items():
+                fill = -np.inf if name == 'profit' else np.nan
+                best[name] = np.full(size, fill, dtype=self.dtype)
+                best[name][best_parcels] = arr[first]
+
+        return best
+
+    def _best_far_fused(self, dev_info, caps, max_heights, parcel_size,
+                        land_cost, weighted_rent, adjustments=None):
+        """
+        Version of _best_far() for the 'fused' solver, which runs
+        _fused_best_far() compiled by numba.
 
-        df['min_max_fars'] = self._min_max_fars(df, resratio)
+        Parameters
+        ----------
+        dev_info : DataFrame
+            Reference table for a form and parking configuration
+        caps, max_heights, parcel_size, land_cost, weighted_rent : ndarray
+            As described in _best_far()
+        adjustments : dict, optional
+            As described in _best_far()
 
-        if self.only_built:
-            df = df.query('min_max_fars > 0 and parcel_size > 0')
+        Returns
+        -------
+        best : dict
+            1-D arrays with one value per parcel, as described in
+            _lookup_frame(), with nans (and -inf profits) for parcels where
+            zoning does not allow any FAR
+        """
+        far_grid = self._as_dtype(dev_info.index.values)
+        parking_sqft_ratio = self._as_dtype(
+            dev_info.parking_sqft_ratio.values)
+        heights = self._as_dtype(dev_info.height.values)
+        months = self._as_dtype(dev_info.construction_months.values)
+        # the scalars are cast to the dtype as numpy does when they
+        # multiply arrays, so that float32 results match the 'grid' solver
+        params = self._as_dtype([
+            self.loan_to_cost_ratio, self.drawdown_factor,
+            self.interest_rate / 12, self.loan_fees,
+            self.building_efficiency, self.cap_rate, .01, 1])
+
+        size = len(caps)
+        # a row per name in ADJUSTMENTS, which leave values unchanged
+        # unless passed
+        adjust = np.zeros((len(ADJUSTMENTS), size), dtype=self.dtype)
+        adjust[0::2] = 1
+        for name, arr in (adjustments or {}).items():
+            adjust[ADJUSTMENTS.index(name)] = arr
+
+        best_rows = np.empty(size, dtype=np.int64)
+        out = np.empty((len(_FUSED_COLUMNS), size), dtype=self.dtype)
+        with utils.span('lookup.profit'):
+            _fused_kernel(
+                far_grid, self._as_dtype(dev_info.ave_cost_sqft.values),
+                parking_sqft_ratio, heights, months, self._as_dtype(caps),
+                self._as_dtype(max_heights), self._as_dtype(parcel_size),
+                self._as_dtype(land_cost), self._as_dtype(weighted_rent),
+                params, adjust, best_rows, out)
+
+        best = dict(zip(_FUSED_COLUMNS, out))
+        found = best_rows >= 0
+        for name, arr in [('fars', far_grid), ('heights', heights),
+                          ('months', months),
+                          ('parking_sqft_ratio', parking_sqft_ratio)]:
+            best[name] = np.where(found, arr[np.where(found, best_rows, 0)],
+                                  np.nan).astype(self.dtype)
+
+        return best
+
+    def _breakpoint_rows(self, dev_info, caps, max_heights):
+        """
+        Find the rows of a reference table at which profit has to be
+        evaluated for the 'breakpoints' solver.  The reference table is
+        split into ranges of FARs over which the cost per sqft, parking
+        ratio and construction time are constant, so that profit is linear
+        in FAR within a range and the maximum is at one of its ends.  For
+        each parcel the candidates are the first FAR of every range and the
+        last FAR of the range which is still allowed by zoning.
 
-        # turn fars and heights into nans which are not allowed by zoning
-        # (so we can fillna with one of the other zoning constraints)
-        fars = np.repeat(cost_sqft_index_col, len(df.index), axis=1)
-        mask = ~np.isnan(fars)  # mask out existing nans for safer comparison
-        mask *= np.nan_to_num(fars) > df.min_max_fars.values + .01
-        fars[mask] = np.nan
+        Parameters
+        ----------
+        dev_info : DataFrame
+            Reference table for a form and parking configuration
+        caps : ndarray
+            The FAR allowed by zoning for each parcel (min_max_fars)
+        max_heights : ndarray
+            The height allowed by zoning for each parcel
 
-        heights = np.repeat(heights, len(df.index), axis=1)
-        mask = ~np.isnan(heights)
-        mask *= np.nan_to_num(heights) > df.max_height.values + .01
-        fars[mask] = np.nan
+        Returns
+        -------
+        rows : tuple or None
+            (candidates x parcels) array of row positions in the reference
+            table, in increasing order for each parcel, and a boolean array
+            of the same shape which is False where the candidate is not
+            allowed by zoning.  None if FARs or heights are not sorted,
+            in which case the 'grid' solver has to be used.
+        """
+        far_grid = self._as_dtype(dev_info.index.values)
+        cost_sqft = dev_info.ave_cost_sqft.values
+        heights = self._as_dtype(dev_info.height.values)
+
+        if np.any(np.diff(far_grid) <= 0):
+            return None
+        if np.any(np.diff(heights[~np.isnan(heights)]) < 0):
+            return None
+
+        # ranges of constant cost per sqft and construction time, split
+        # where the cost becomes nan (FARs that cannot be built, such as
+        # retail and industrial above their maximum height) - nan ranges
+        # are never candidates
+        key = np.column_stack([dev_info.build_cost_sqft.values,
+                               dev_info.construction_months.values,
+                               np.isnan(cost_sqft)])
+        starts = np.r_[True, np.any(key[1:] != key[:-1], axis=1)]
+        lo = np.flatnonzero(starts)
+        hi = np.r_[lo[1:], len(key)] - 1
+        buildable = ~np.isnan(cost_sqft[lo])
+        lo, hi = lo[buildable, None], hi[buildable, None]
+
+        # number of rows allowed by zoning for each parcel, where nan
+        # heights do not count as the cost is also nan
+        heights = np.fmax.accumulate(
+            np.where(np.isnan(heights), -np.inf, heights))
+        allowed = np.minimum(
+            np.searchsorted(far_grid, self._as_dtype(caps) + .01,
+                            side='right'),
+            np.searchsorted(heights, self._as_dtype(max_heights) + .01,
+                            side='right'))
+
+        if len(lo) == 0:
+            shape = (1, len(caps))
+            return np.zeros(shape, dtype='int'), np.zeros(shape, dtype='bool')
+
+        last = allowed - 1
+        rows = np.empty((2 * len(lo), len(caps)), dtype='int')
+        rows[0::2] = lo
+        rows[1::2] = np.clip(last, lo, hi)
+        valid = np.repeat(lo <= last, 2, axis=0)
+        return rows, valid
+
+    def _profit_arrays(self, fars, parcel_size, land_cost, weighted_rent,
+                       cost_sqft, parking_sqft_ratio, months, form=None,
+                       df=None, modify_revenues=None, modify_costs=None,
+                       modify_profits=None, adjustments=None, params=None):
+        """
+        The profit algebra at the core of the pro forma.  Reference values
+        (cost_sqft, parking_sqft_ratio and months) vary by FAR along the
+        second to last axis, parcel values vary along the last axis, and all
+        arguments are broadcast against each other, so the same computation
+        serves a single form and parking configuration or a stack of them.
+
+        Parameters
+        ----------
+        fars : ndarray
+            FARs to test, with nans where zoning does not allow the FAR
+        parcel_size, land_cost, weighted_rent : ndarray
+            Parcel values
+        cost_sqft, parking_sqft_ratio, months : ndarray
+            Reference table values for each FAR
+        form : str, optional
+            Name of form, passed to the callbacks
+        df : DataFrame, optional
+            Parcel DataFrame, passed to the callbacks
+        modify_revenues, modify_costs, modify_profits : func, optional
+            Callbacks as described in lookup()
+        adjustments : dict, optional
+            Parcel values keyed by the names in ADJUSTMENTS, as described in
+            lookup()
+        params : dict, optional
+            Values of FINANCE_PARAMETERS which replace the attributes of the
+            pro forma, and are broadcast against the other arguments
+
+        Returns
+        -------
+        arrs : dict
+            Arrays of building_bulks, building_costs, total_financing_costs,
+            total_development_costs, building_revenue and profit, with nan
+            profits set to -inf
+        """
+        p = {name: getattr(self, name) for name in FINANCE_PARAMETERS}
+        p.update(params or {})
 
-        # PROFIT CALCULATION
         # parcel sizes * possible fars
-        building_bulks = fars * df.parcel_size.values
+        building_bulks = fars * parcel_size
 
         # cost to build the new building
-        building_costs = building_bulks * cost_sqft_col
+        building_costs = building_bulks * cost_sqft
 
         # add cost to buy the current building
-        total_construction_costs = building_costs + df.land_cost.values
+        total_construction_costs = building_costs + land_cost
 
         # Financing costs
-        loan_amount = total_construction_costs * self.loan_to_cost_ratio
-        months = np.repeat(months, len(df.index), axis=1)
+        loan_amount = total_construction_costs * p['loan_to_cost_ratio']
         interest = (loan_amount
-                    * self.drawdown_factor
-                    * (self.interest_rate / 12 * months))
-        points = loan_amount * self.loan_fees
+                    * p['drawdown_factor']
+                    * (p['interest_rate'] / 12 * months))
+        points = loan_amount * p['loan_fees']
         total_financing_costs = interest + points
         total_development_costs = (total_construction_costs
                                    + total_financing_costs)
@@ -736,11 +2292,16 @@ class SqFtProForma(object):
         building_revenue = (building_bulks
                             * (1 - parking_sqft_ratio)
                             * self.building_efficiency
-                            * df.weighted_rent.values
-                            / self.cap_rate)
+                            * weighted_rent
+                            / p['cap_rate'])
 
-        # profit for each form, including user modification of
-        # revenues, costs, and/or profits
+        # profit for each form, including declarative adjustments and user
+        # modification of revenues, costs, and/or profits
+        adjustments = adjustments or {}
+        building_revenue = self._adjust(building_revenue, adjustments,
+                                        'revenue')
+        total_development_costs = self._adjust(total_development_costs,
+                                               adjustments, 'cost')
 
         building_revenue = (modify_revenues(self, form, df, building_revenue)
                             if modify_revenues else building_revenue)
@@ -750,34 +2311,85 @@ class SqFtProForma(object):
             if modify_costs else total_development_costs)
 
         profit = building_revenue - total_development_costs
+        profit = self._adjust(profit, adjustments, 'profit')
 
         profit = (modify_profits(self, form, df, profit)
                   if modify_profits else profit)
 
-        profit = profit.astype('float')
+        profit = profit.astype(self.dtype)
         profit[np.isnan(profit)] = -np.inf
-        maxprofitind = np.argmax(profit, axis=0)
 
-        def twod_get(indexes, arr):
-            return arr[indexes, np.arange(indexes.size)].astype('float')
+        return {'building_bulks': building_bulks,
+                'building_costs': building_costs,
+                'total_financing_costs': total_financing_costs,
+                'total_development_costs': total_development_costs,
+                'building_revenue': building_revenue,
+                'profit': profit}
+
+    @staticmethod
+    def _adjust(values, adjustments, kind):
+        """
+        Apply the factor and offset adjustments of one kind (revenue, cost
+        or profit) to values, if there are any.
+
+        """
+        if kind + '_factor' in adjustments:
+            values = values * adjustments[kind + '_factor']
+        if kind + '_offset' in adjustments:
+            values = values + adjustments[kind + '_offset']
+        return values
+
+    def _as_dtype(self, values):
+        """
+        Cast values to an array of the dtype used for the computations.
+
+        """
+        return np.asarray(values, dtype=self.dtype)
+
+    def _lookup_frame(self, form, parking_config, best, index, columns):
+        """
+        Assemble the output DataFrame of a lookup for one form and parking
+        configuration from the values at the most profitable FAR.
+
+        Parameters
+        ----------
+        form : str
+            Name of form
+        parking_config : str
+            Name of parking configuration
+        best : dict
+            1-D arrays with one value per row of df, keyed like the arrays
+            returned by _profit_arrays() plus fars, heights, months and
+            parking_sqft_ratio
+        index : Index
+            Ids of the parcels that were evaluated
+        columns : DataFrame or dict
+            The parcel values of the pass_through columns, in the order of
+            index
+
+        Returns
+        -------
+        outdf : DataFrame
+        """
+        resratio = float(self.res_ratios[form])
+        nonresratio = 1.0 - resratio
 
         outdf = pd.DataFrame({
-            'building_sqft': twod_get(maxprofitind, building_bulks),
-            'building_cost': twod_get(maxprofitind, building_costs),
-            'parking_ratio': parking_sqft_ratio[maxprofitind].flatten(),
-            'stories': twod_get(maxprofitind,
-                                heights) / self.height_per_story,
-            'total_cost': twod_get(maxprofitind, total_development_costs),
-            'building_revenue': twod_get(maxprofitind, building_revenue),
-            'max_profit_far': twod_get(maxprofitind, fars),
-            'max_profit': twod_get(maxprofitind, profit),
+            'building_sqft': best['building_bulks'],
+            'building_cost': best['building_costs'],
+            'parking_ratio': best['parking_sqft_ratio'],
+            'stories': best['heights'] / self.height_per_story,
+            'total_cost': best['total_development_costs'],
+            'building_revenue': best['building_revenue'],
+            'max_profit_far': best['fars'],
+            'max_profit': best['profit'],
             'parking_config': parking_config,
-            'construction_time': twod_get(maxprofitind, months),
-            'financing_cost': twod_get(maxprofitind, total_financing_costs)
-        }, index=df.index)
+            'construction_time': best['months'],
+            'financing_cost': best['total_financing_costs']
+        }, index=index)
 
-        if self.pass_through:
-            outdf[self.pass_through] = df[self.pass_through]
+        for col in self.pass_through:
+            outdf[col] = columns[col]
 
         outdf["residential_sqft"] = (outdf.building_sqft *
                                      self.building_efficiency *
@@ -848,6 +2460,63 @@ class SqFtProForma(object):
             return df[
                 ['max_far_from_heights', 'max_far']].min(axis=1)
 
+    def _min_max_fars_array(self, parcels, resratio):
+        """
+        Version of _min_max_fars() for parcel columns, which returns the
+        smallest of the FARs allowed by max_height, max_far and max_dua
+        as an array, ignoring missing limits.
+
+        Parameters
+        ----------
+        parcels : ParcelColumns
+            Parcels passed to the lookup() method
+        resratio : numeric
+            Residential ratio for this form
+
+        Returns
+        -------
+        ndarray
+        """
+        return reduce(np.fmin, self._far_limits(parcels, resratio).values())
+
+    def _far_limits(self, parcels, resratio):
+        """
+        The FARs allowed by each of the zoning limits.
+
+        Parameters
+        ----------
+        parcels : ParcelColumns
+            Parcels passed to the lookup() method
+        resratio : numeric
+            Residential ratio for this form
+
+        Returns
+        -------
+        limits : dict
+            Arrays keyed by max_far_from_heights, max_far and, if max_dua
+            is passed and resratio is positive, max_far_from_dua
+        """
+        limits = {}
+        limits['max_far_from_heights'] = (parcels['max_height']
+                                          / self.height_per_story
+                                          * self.parcel_coverage)
+        limits['max_far'] = np.asarray(parcels['max_far'], dtype='float64')
+
+        if 'max_dua' in parcels and resratio > 0:
+            # if max_dua is in the data frame, ave_unit_size must also be there
+            assert 'ave_unit_size' in parcels
+
+            # see _min_max_fars() for the derivation
+            parcel_size = parcels['parcel_size']
+            limits['max_far_from_dua'] = (
+                parcels['max_dua'] * (parcel_size / 43560) *
+                parcels['ave_unit_size'] /
+                self.building_efficiency /
+                resratio /
+                parcel_size)
+
+        return limits
+
     def get_debug_info(self, form, parking_config):
         """
         Get the debug info after running the pro forma for a given form and
@@ -945,10 +2614,273 @@ class SqFtProForma(object):
         plt.savefig('even_rents.png', bbox_inches=0)
 
 
+_lookup_worker_state = {}
+
+
+def _init_lookup_worker(pf, index, columns, shared, other, hooks):
+    """
+    Initializer for the processes used by SqFtProForma._lookup_parallel().
+    Attaches the shared parcel columns and keeps the pro forma around for
+    all the shards evaluated by this process.
+
+    """
+    from multiprocessing import shared_memory
+
+    values = dict(other)
+    blocks = []
+    for name, shm_name, dtype in shared:
+        shm = shared_memory.SharedMemory(name=shm_name)
+        blocks.append(shm)
+        values[name] = np.ndarray((len(index),), dtype=dtype,
+                                  buffer=shm.buf)
+
+    _lookup_worker_state.update(pf=pf, index=index, columns=columns,
+                                values=values, blocks=blocks, hooks=hooks)
+
+
+def _lookup_shard(forms, start, stop, batched, solver):
+    """
+    Evaluate the parcels in rows start to stop in a worker process.
+
+    """
+    state = _lookup_worker_state
+    pf = state['pf']
+    df = ParcelColumns({name: state['values'][name][start:stop]
+                        for name in state['columns']},
+                       index=state['index'][start:stop])
+    if any(state['hooks']):
+        # the callbacks expect a DataFrame
+        df = df.to_frame(state['columns'])
+
+    if batched:
+        return pf._lookup_chunk(forms, df, state['hooks'], solver)
+    return {form: pf.lookup(form, df, *state['hooks'], solver=solver)
+            for form in forms}
+
+
+_FUSED_COLUMNS = ['building_bulks', 'building_costs', 'total_financing_costs',
+                  'total_development_costs', 'building_revenue', 'profit']
+
+
+def _fused_best_far(far_grid, cost_sqft, parking_sqft_ratio, heights, months,
+                    caps, max_heights, parcel_size, land_cost, weighted_rent,
+                    params, adjust, best_rows, out):
+    """
+    Loop over parcels and FARs computing the same profit as
+    SqFtProForma._profit_arrays() one value at a time, and keep the values
+    of the most profitable FAR allowed by zoning for each parcel.  This is
+    compiled by numba, when installed, for the 'fused' solver.
+
+    Parameters
+    ----------
+    far_grid, cost_sqft, parking_sqft_ratio, heights, months : ndarray
+        Reference table values for each FAR
+    caps, max_heights, parcel_size, land_cost, weighted_rent : ndarray
+        Parcel values
+    params : ndarray
+        loan_to_cost_ratio, drawdown_factor, monthly interest rate,
+        loan_fees, building_efficiency, cap_rate and the tolerance of the
+        zoning comparisons, and one
+    adjust : ndarray
+        The factors and offsets of ADJUSTMENTS (rows) for each parcel
+        (columns)
+    best_rows : ndarray
+        Filled with the row of the reference table chosen for each parcel,
+        or -1 when zoning does not allow any FAR
+    out : ndarray
+        Filled with the values of _FUSED_COLUMNS (rows) for each parcel
+        (columns), with nans and -inf profits when best_rows is -1
+    """
+    loan_to_cost_ratio = params[0]
+    drawdown_factor = params[1]
+    monthly_rate = params[2]
+    loan_fees = params[3]
+    building_efficiency = params[4]
+    cap_rate = params[5]
+    tolerance = params[6]
+    one = params[7]
+
+    for j in range(caps.shape[0]):
+        best_rows[j] = -1
+        for k in range(out.shape[0]):
+            out[k, j] = np.nan
+        out[5, j] = -np.inf
+
+        max_far = caps[j] + tolerance
+        max_height = max_heights[j] + tolerance
+        for i in range(far_grid.shape[0]):
+            far = far_grid[i]
+            if np.isnan(far) or far > max_far or heights[i] > max_height:
+                continue
+
+            building_bulk = far * parcel_size[j]
+            building_cost = building_bulk * cost_sqft[i]
+            total_construction_cost = building_cost + land_cost[j]
+            loan_amount = total_construction_cost * loan_to_cost_ratio
+            interest = (loan_amount * drawdown_factor *
+                        (monthly_rate * months[i]))
+            points = loan_amount * loan_fees
+            total_financing_cost = interest + points
+            total_development_cost = (total_construction_cost +
+                                      total_financing_cost)
+            building_revenue = (building_bulk *
+                                (one - parking_sqft_ratio[i]) *
+                                building_efficiency *
+                                weighted_rent[j] /
+                                cap_rate)
+            building_revenue = building_revenue * adjust[0, j] + adjust[1, j]
+            total_development_cost = (total_development_cost * adjust[2, j] +
+                                      adjust[3, j])
+            profit = building_revenue - total_development_cost
+            profit = profit * adjust[4, j] + adjust[5, j]
+
+            # strictly greater keeps the smallest FAR on ties, like
+            # np.argmax, and skips nan profits
+            if profit > out[5, j]:
+                best_rows[j] = i
+                out[0, j] = building_bulk
+                out[1, j] = building_cost
+                out[2, j] = total_financing_cost
+                out[3, j] = total_development_cost
+                out[4, j] = building_revenue
+                out[5, j] = profit
+
+
+_fused_kernel = (None if numba is None else
+                 numba.njit(nogil=True, cache=True)(_fused_best_far))
+
+
+class ParcelColumns(object):
+    """
+    Read-only columns of parcel data as 1-D arrays, which is how lookup()
+    and lookup_all() read the parcels.  Columns are only converted to
+    arrays when they are used, and neither the data nor the arrays are
+    copied, except for pyarrow columns that have nulls or several chunks.
+
+    Parameters
+    ----------
+    data : DataFrame, dict of arrays, structured ndarray or pyarrow.Table
+        The parcel columns described in SqFtProForma.lookup()
+    index : array-like, optional
+        The parcel ids.  By default, the index of a DataFrame, a parcel_id
+        column if there is one, or else the position of each parcel.
+    """
+
+    def __init__(self, data, index=None):
+        if isinstance(data, ParcelColumns):
+            get, columns, default = data.__getitem__, data.columns, data.index
+        elif isinstance(data, pd.DataFrame):
+            get, columns, default = (lambda name: data[name].values,
+                                     data.columns, data.index)
+        elif getattr(data, 'dtype', None) is not None and data.dtype.names:
+            get, columns, default = data.__getitem__, data.dtype.names, None
+        elif hasattr(data, 'column_names') and hasattr(data, 'num_rows'):
+            # a pyarrow Table or RecordBatch
+            get, columns, default = (
+                lambda name: np.asarray(data.column(name)),
+                data.column_names, None)
+        else:
+            get, columns, default = (lambda name: np.asarray(data[name]),
+                                     list(data.keys()), None)
+
+        self._get = get
+        self.columns = list(columns)
+        self._values = {}
+
+        if index is None:
+            index = default
+        if index is None:
+            if 'parcel_id' in self.columns:
+                index = pd.Index(self['parcel_id'], name='parcel_id')
+            else:
+                size = len(self[self.columns[0]]) if self.columns else 0
+                index = pd.RangeIndex(size)
+        self.index = pd.Index(index)
+
+    @classmethod
+    def _from_getter(cls, get, columns, index):
+        parcels = cls.__new__(cls)
+        parcels._get = get
+        parcels.columns = list(columns)
+        parcels._values = {}
+        parcels.index = index
+        return parcels
+
+    def __getitem__(self, name):
+        if name not in self._values:
+            if name not in self.columns:
+                raise KeyError(name)
+            self._values[name] = self._get(name)
+        return self._values[name]
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def iloc(self):
+        """
+        Select parcels by position, with a slice, positions or a boolean
+        mask, e.g. ``parcels.iloc[:1000]``.  Slices are views.
+
+        """
+        return _ParcelColumnsIndexer(self)
+
+    def with_columns(self, values):
+        """
+        Return parcels with some columns replaced or added.
+
+        Parameters
+        ----------
+        values : dict
+            Arrays keyed by column name
+
+        Returns
+        -------
+        ParcelColumns
+        """
+        columns = self.columns + [col for col in values
+                                  if col not in self.columns]
+        return self._from_getter(
+            lambda name: values[name] if name in values else self[name],
+            columns, self.index)
+
+    def to_frame(self, columns=None):
+        """
+        Copy some or all of the columns into a DataFrame indexed by parcel.
+
+        Parameters
+        ----------
+        columns : list of strings, optional
+
+        Returns
+        -------
+        DataFrame
+        """
+        columns = self.columns if columns is None else list(columns)
+        return pd.DataFrame({col: self[col] for col in columns},
+                            index=self.index, columns=columns)
+
+
+class _ParcelColumnsIndexer(object):
+
+    def __init__(self, parcels):
+        self.parcels = parcels
+
+    def __getitem__(self, key):
+        parcels = self.parcels
+        return ParcelColumns._from_getter(lambda name: parcels[name][key],
+                                          parcels.columns,
+                                          parcels.index[key])
+
+
 class SqFtProFormaReference(object):
     """
     Generate reference table for square foot pro forma analysis. Table is saved
-    as the `reference_dict` attribute.
+    as the `reference_dict` attribute.  The tables are computed in double
+    precision and then cast to `dtype`.
     """
 
     def __init__(self, parcel_sizes, fars, forms,
@@ -956,7 +2888,7 @@ class SqFtProFormaReference(object):
                  parking_configs, costs, heights_for_costs, parking_sqft_d,
                  parking_cost_d, height_per_story, max_retail_height,
                  max_industrial_height, construction_sqft_for_months,
-                 construction_months, **kwargs):
+                 construction_months, dtype='float64', **kwargs):
 
         self.fars = fars
         self.parcel_sizes = parcel_sizes
@@ -975,6 +2907,7 @@ class SqFtProFormaReference(object):
         self.max_industrial_height = max_industrial_height
         self.construction_sqft_for_months = construction_sqft_for_months
         self.construction_months = construction_months
+        self.dtype = dtype
 
         self.tiled_parcel_sizes = columnize(
             np.repeat(self.parcel_sizes, self.fars.size))
@@ -1081,7 +3014,7 @@ class SqFtProFormaReference(object):
             industrial_fars_over_max = self.fars > self.max_industrial_height
             df.loc[industrial_fars_over_max, 'ave_cost_sqft'] = np.nan
 
-        return df
+        return df.astype(self.dtype)
 
     def _building_cost(self, use_mix, stories):
         """
@@ -1236,3 +3169,35 @@ class SqFtProFormaReference(object):
         # Dot product to get appropriate time for uses being evaluated
         construction_times = np.dot(months_array_all_uses, use_mix)
         return construction_times
+
+
+def main(argv=None):
+    """
+    Prewarm the reference table cache from the command line, e.g.::
+
+        python -m developer.sqftproforma --cache-dir cache proforma.yaml
+
+    The default configuration is used if no YAML files are passed.
+
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Prewarm the SqFtProForma reference table cache.')
+    parser.add_argument('configs', nargs='*',
+                        help='YAML configuration files')
+    parser.add_argument('--cache-dir', required=True,
+                        help='directory in which to cache reference tables')
+    args = parser.parse_args(argv)
+
+    for config in args.configs or [None]:
+        if config is None:
+            pf = SqFtProForma.from_defaults(cache_dir=args.cache_dir)
+        else:
+            pf = SqFtProForma.from_yaml(str_or_buffer=config,
+                                        cache_dir=args.cache_dir)
+        print('{}: {}'.format(config or 'defaults', pf.reference_cache_path))
+
+
+if __name__ == '__main__':
+    main()
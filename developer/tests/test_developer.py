@@ -5,6 +5,7 @@ import os
 
 from developer import sqftproforma as sqpf
 from developer import develop
+from developer import utils
 
 
 @pytest.fixture
@@ -113,3 +114,240 @@ def test_developer_yaml_roundtrip(res10):
 def test_developer_compute_forms_max_profit(res10):
     dev = develop.Developer(**res10)
     dev.keep_form_with_max_profit()
+
+
+def test_keep_form_with_max_profit(res10):
+    feasibility = pd.concat([
+        pd.DataFrame({'max_profit': [2.0, 1.0, 3.0],
+                      'building_sqft': [20.0, 10.0, 30.0]},
+                     index=['c', 'b', 'a']),
+        pd.DataFrame({'max_profit': [1.0, 1.0, float('nan')],
+                      'building_sqft': [5.0, 6.0, 7.0]},
+                     index=['c', 'b', 'd'])],
+        keys=['residential', 'office'], axis=1)
+    res10['feasibility'] = feasibility
+    dev = develop.Developer(**res10)
+
+    df = dev.keep_form_with_max_profit()
+    assert df.index.tolist() == ['a', 'b', 'c']
+    assert df.columns.tolist() == ['form', 'building_sqft', 'max_profit']
+    # ties go to the form which comes first alphabetically
+    assert df.form.tolist() == ['residential', 'office', 'residential']
+    assert df.building_sqft.tolist() == [30.0, 6.0, 20.0]
+
+    df = dev.keep_form_with_max_profit(['office'])
+    assert df.index.tolist() == ['b', 'c']
+
+
+def test_developer_random_state(res):
+    dev = develop.Developer(target_units=10, random_state=0, **res)
+    bldgs = dev.pick()
+    assert len(bldgs) == 1
+    assert len(dev.feasibility) == 2
+
+    picks = [develop.Developer(target_units=10, random_state=1, **res).pick()
+             for _ in range(2)]
+    pd.testing.assert_frame_equal(picks[0], picks[1])
+
+
+def test_sample_buildings():
+    df = pd.DataFrame({'net_units': [5.0, 5.0, 5.0, 5.0]},
+                      index=['a', 'b', 'c', 'd'])
+    p = [.5, .5, 0, 0]
+    dev = develop.Developer(None, 'residential', 8, None, None, None,
+                            random_state=0)
+    assert sorted(dev._select_buildings(df, p, None)) == ['a', 'b']
+
+    # buildings with no probability are never drawn
+    dev.target_units = 6
+    for _ in range(10):
+        build_idx = dev._select_buildings(df, [.2, .8, 0, 0], None)
+        assert len(build_idx) == 2 and set(build_idx) == {'a', 'b'}
+
+    # nothing is drawn when no building has a probability
+    assert len(dev._select_buildings(df, [0, 0, 0, 0], None)) == 0
+
+
+def test_pick_replicates(res10):
+    dev = develop.Developer(random_state=0, **res10)
+    replicates = dev.pick_replicates(200)
+    assert len(dev.feasibility) == 3
+    assert replicates.index.name == 'parcel_id'
+    assert (replicates.times_built <= 200).all()
+    assert replicates.build_probability.sum() >= 1
+    assert (replicates.expected_net_units ==
+            replicates.build_probability * replicates.net_units).all()
+
+    pd.testing.assert_frame_equal(dev.pick_replicates(200), replicates)
+    pd.testing.assert_frame_equal(dev.pick_replicates(200, n_jobs=2),
+                                  replicates)
+
+    dev.target_units = 1000
+    replicates = dev.pick_replicates(5)
+    assert (replicates.build_probability == 1).all()
+
+
+def test_zone_targets(res):
+    zones = pd.Series(['x', 'y', 'x'], index=['a', 'b', 'c'])
+    dev = develop.Developer(target_units={'x': 1000, 'y': 0}, zones=zones,
+                            random_state=0, **res)
+    bldgs = dev.pick()
+    assert sorted(bldgs.parcel_id) == ['a', 'c']
+    assert sorted(dev.feasibility.index) == ['b']
+
+    dev = develop.Developer(target_units={'x': 1, 'y': 1}, zones=zones,
+                            random_state=0, **res)
+    bldgs = dev.pick()
+    assert len(bldgs) == 2
+    assert sorted(zones[bldgs.parcel_id]) == ['x', 'y']
+
+    replicates = dev.pick_replicates(50)
+    assert (replicates.times_built.groupby(zones).sum() == 50).all()
+
+    with pytest.raises(ValueError):
+        develop.Developer(target_units={'x': 1}, **res).pick()
+
+    # zones are not needed when a custom function does the selection
+    dev = develop.Developer(target_units={'x': 1}, **res)
+    bldgs = dev.pick(custom_selection_func=lambda self, df, p: df.index[:1])
+    assert len(bldgs) == 1
+
+
+def test_parquet_roundtrip(simple_dev_inputs, res10, tmpdir):
+    pytest.importorskip('pyarrow')
+    pf = sqpf.SqFtProForma.from_defaults()
+    path = str(tmpdir.join('feasibility.parquet'))
+    feasibility = pf.lookup_to_parquet(path, simple_dev_inputs,
+                                       ['residential', 'office'])
+
+    pd.testing.assert_frame_equal(utils.read_parquet(path), feasibility)
+    # office is not feasible for these parcels, so is not in the file
+    assert feasibility.columns.get_level_values(0).unique().tolist() == [
+        'residential']
+    df = utils.read_parquet(path, 'residential', ['max_profit'])
+    pd.testing.assert_frame_equal(df, feasibility[[('residential',
+                                                    'max_profit')]])
+    df = utils.read_parquet(path, 'office')
+    assert df.columns.nlevels == 2
+    assert len(df.columns) == 0
+    assert df.index.equals(feasibility.index)
+
+    del res10['feasibility']
+    dev = develop.Developer.from_parquet(path, columns=['building_cost'],
+                                         **res10)
+    forms = dev.feasibility.columns.get_level_values(0).unique()
+    assert forms.tolist() == ['residential']
+    assert 'building_cost' in dev.feasibility['residential']
+    assert 'total_cost' not in dev.feasibility['residential']
+
+    new_buildings = dev.pick()
+    path = str(tmpdir.join('new_buildings.parquet'))
+    utils.to_parquet(new_buildings, path)
+    pd.testing.assert_frame_equal(utils.read_parquet(path), new_buildings)
+
+
+def test_feasibility_dict_of_forms(res10):
+    feasibility = {
+        'residential': pd.DataFrame({'max_profit': [2.0, 1.0, 3.0],
+                                     'building_sqft': [20.0, 10.0, 30.0]},
+                                    index=['c', 'b', 'a']),
+        'office': pd.DataFrame({'max_profit': [1.0, 1.0, float('nan')],
+                                'building_sqft': [5.0, 6.0, 7.0],
+                                'stories': [1.0, 1.0, 1.0]},
+                               index=['c', 'b', 'd'])}
+    wide = pd.concat(feasibility.values(), keys=feasibility.keys(), axis=1)
+
+    res10['feasibility'] = feasibility
+    dev = develop.Developer(**res10)
+    res10['feasibility'] = wide
+    expected = develop.Developer(**res10)
+
+    pd.testing.assert_frame_equal(dev.feasibility, wide)
+    for forms in [None, ['office'], ['residential', 'office']]:
+        pd.testing.assert_frame_equal(
+            dev.keep_form_with_max_profit(forms),
+            expected.keep_form_with_max_profit(forms))
+
+    dev._drop_built_buildings(['a', 'c'])
+    expected._drop_built_buildings(['a', 'c'])
+    pd.testing.assert_frame_equal(dev.feasibility, expected.feasibility)
+    pd.testing.assert_frame_equal(dev.keep_form_with_max_profit(),
+                                  expected.keep_form_with_max_profit())
+
+
+def test_prepare_candidates(res10):
+    res10['ave_unit_size'] = pd.Series([300, 650, 650],
+                                       index=['a', 'b', 'c'])
+    res10['current_units'] = pd.Series([0, 0, 1000], index=['c', 'b', 'a'])
+    dev = develop.Developer(**res10)
+    df = pd.DataFrame({'max_profit_far': [1.0, 0.0, 1.0, 1.0],
+                       'residential_sqft': [1300.0, 1300.0, 1300.0, 1300.0],
+                       'non_residential_sqft': [800.0, 800.0, 800.0, 800.0]},
+                      index=['a', 'b', 'c', 'd'])
+
+    df = dev._prepare_candidates(df)
+    # b is not profitable, a has more units already and d has no parcel
+    assert df.index.tolist() == ['c']
+    assert df.ave_unit_size.tolist() == [650]
+    assert df.net_units.tolist() == [2]
+    assert df.job_spaces.tolist() == [2]
+    # the Series passed in is left alone
+    assert dev.ave_unit_size.tolist() == [300, 650, 650]
+
+
+def test_joint_pick(res10):
+    res10['current_job_spaces'] = pd.Series([1], index=['b'])
+    dev = develop.Developer(random_state=0, **res10)
+    df = pd.DataFrame({'max_profit_far': [1.0, 1.0, 1.0],
+                       'residential_sqft': [1300.0, 0.0, 650.0],
+                       'non_residential_sqft': [0.0, 800.0, 400.0]},
+                      index=['a', 'b', 'c'])
+
+    df = dev._prepare_candidates(df, joint=True)
+    assert df.net_units.tolist() == [2, 0, 1]
+    assert df.net_job_spaces.tolist() == [0, 1, 1]
+
+    p = pd.Series(1.0, index=df.index)
+    dev.target_units = 1000
+    # the job space in the mixed use building on c is enough
+    assert sorted(dev._select_joint_buildings(df, p, 1)) == ['a', 'c']
+    assert sorted(dev._select_joint_buildings(df, p, 2)) == ['a', 'b', 'c']
+    dev.target_units = 0
+    assert dev._select_joint_buildings(df, p, 1).tolist() in (['b'], ['c'])
+
+    dev = develop.Developer(random_state=0, **res10)
+    bldgs = dev.pick(target_job_spaces=0)
+    assert len(bldgs) == 1
+    assert 'net_job_spaces' in bldgs
+    assert len(dev.feasibility) == 2
+
+
+def test_drop_built_buildings(res10):
+    dev = develop.Developer(**res10)
+    feasibility = dev.feasibility
+    dev.compact_fraction = .5
+
+    dev._drop_built_buildings(['b'])
+    assert dev.feasibility.index.tolist() == ['a', 'c']
+    # the full table is kept until enough rows are dropped
+    assert len(dev._available) == 3
+    assert dev.keep_form_with_max_profit().index.tolist() == ['a', 'c']
+    with pytest.raises(KeyError):
+        dev._drop_built_buildings(['b'])
+
+    dev._drop_built_buildings(['c'])
+    assert len(dev._available) == 1
+    pd.testing.assert_frame_equal(dev.feasibility, feasibility.loc[['a']])
+
+    dev.feasibility = feasibility
+    assert len(dev.feasibility) == 3
+
+
+def test_pick_spans(res10):
+    dev = develop.Developer(**res10)
+    with utils.SpanRecorder() as recorder:
+        dev.pick()
+
+    assert recorder.summary().index.tolist() == [
+        'pick.reshape', 'pick.filter', 'pick.probabilities',
+        'pick.selection', 'pick.drop', 'pick.prepare', 'pick']
@@ -1,11 +1,14 @@
 from __future__ import print_function, division, absolute_import
+import multiprocessing
 import os
+import sys
 
 import pandas as pd
 import numpy as np
 import pytest
 
 from developer import sqftproforma as sqpf
+from developer import utils
 
 
 @pytest.fixture
@@ -22,6 +25,24 @@ def simple_dev_inputs():
         index=['a', 'b', 'c'])
 
 
+@pytest.fixture
+def random_dev_inputs():
+    rs = np.random.RandomState(0)
+    n = 500
+    return pd.DataFrame(
+        {'residential': rs.uniform(10, 50, n),
+         'office': rs.uniform(10, 30, n),
+         'retail': rs.uniform(5, 30, n),
+         'industrial': rs.uniform(5, 30, n),
+         'land_cost': rs.uniform(1e4, 3e6, n),
+         'parcel_size': rs.uniform(1e3, 5e4, n),
+         'max_far': rs.uniform(0, 8, n),
+         'max_height': rs.uniform(10, 200, n),
+         'max_dua': rs.uniform(0, 100, n),
+         'ave_unit_size': rs.uniform(500, 1500, n)},
+        index=rs.permutation(n))
+
+
 @pytest.fixture
 def max_dua_dev_inputs():
     sdi = simple_dev_inputs()
@@ -238,3 +259,444 @@ class TestSqFtProFormaDebug(object):
     def test_sqftproforma_debug(self):
         pf = sqpf.SqFtProForma.from_defaults()
         pf._debug_output()
+
+
+def test_lookup_all(simple_dev_inputs):
+    pf = sqpf.SqFtProForma.from_defaults()
+    simple_dev_inputs.land_cost /= 100
+
+    d = {form: pf.lookup(form, simple_dev_inputs)
+         for form in pf.forms_to_test}
+    expected = pd.concat(d.values(), keys=d.keys(), axis=1)
+
+    out = pf.lookup_all(simple_dev_inputs)
+    pd.testing.assert_frame_equal(out, expected)
+
+    out = pf.lookup_all(simple_dev_inputs,
+                        forms=['residential', 'office'])
+    assert (out.columns.get_level_values(0).unique().tolist() ==
+            ['residential', 'office'])
+
+
+def revenue_callback(self, form, df, revenues):
+    return revenues * .8
+
+
+def test_lookup_all_callbacks(simple_dev_inputs):
+    pf = sqpf.SqFtProForma.from_defaults()
+
+    out = pf.lookup_all(simple_dev_inputs, forms=['residential'],
+                        modify_revenues=revenue_callback)
+    expected = pf.lookup('residential', simple_dev_inputs,
+                         modify_revenues=revenue_callback)
+    pd.testing.assert_frame_equal(out['residential'], expected)
+
+
+def test_lookup_chunksize(simple_dev_inputs):
+    pf = sqpf.SqFtProForma.from_defaults()
+    simple_dev_inputs.land_cost /= 100
+
+    expected = pf.lookup('residential', simple_dev_inputs)
+    out = pf.lookup('residential', simple_dev_inputs, chunksize=2)
+    pd.testing.assert_frame_equal(out, expected)
+
+    chunks = list(pf.iter_lookup('residential', simple_dev_inputs, 2))
+    assert [len(chunk) for chunk in chunks] == [2, 1]
+
+    expected = pf.lookup_all(simple_dev_inputs)
+    out = pf.lookup_all(simple_dev_inputs, chunksize=1)
+    pd.testing.assert_frame_equal(out, expected)
+
+    with pytest.raises(ValueError):
+        pf.lookup('residential', simple_dev_inputs, chunksize=0)
+
+
+def test_lookup_n_jobs(simple_dev_inputs):
+    pf = sqpf.SqFtProForma.from_defaults()
+    simple_dev_inputs.land_cost /= 100
+
+    expected = pf.lookup('residential', simple_dev_inputs,
+                         modify_revenues=revenue_callback)
+    out = pf.lookup('residential', simple_dev_inputs, n_jobs=2,
+                    modify_revenues=revenue_callback)
+    pd.testing.assert_frame_equal(out, expected)
+
+    expected = pf.lookup_all(simple_dev_inputs)
+    out = pf.lookup_all(simple_dev_inputs, n_jobs=2, chunksize=1)
+    pd.testing.assert_frame_equal(out, expected)
+
+
+def test_lookup_n_jobs_without_shared_memory(simple_dev_inputs, monkeypatch):
+    # as on Pythons before 3.8, which the serial lookup still supports
+    monkeypatch.delattr(multiprocessing, 'shared_memory', raising=False)
+    monkeypatch.setitem(sys.modules, 'multiprocessing.shared_memory', None)
+    pf = sqpf.SqFtProForma.from_defaults()
+
+    with pytest.raises(ImportError, match='Python 3.8'):
+        pf.lookup('residential', simple_dev_inputs, n_jobs=2)
+    pf.lookup('residential', simple_dev_inputs, n_jobs=1)
+
+
+def test_lookup_breakpoints_solver(simple_dev_inputs):
+    pf = sqpf.SqFtProForma.from_defaults()
+    simple_dev_inputs.land_cost /= 100
+    simple_dev_inputs['max_height'] = [40, np.nan, 200]
+
+    for form in pf.forms_to_test:
+        expected = pf.lookup(form, simple_dev_inputs)
+        out = pf.lookup(form, simple_dev_inputs, solver='breakpoints')
+        pd.testing.assert_frame_equal(out, expected)
+
+    expected = pf.lookup_all(simple_dev_inputs)
+    out = pf.lookup_all(simple_dev_inputs, solver='breakpoints')
+    pd.testing.assert_frame_equal(out, expected)
+
+    with pytest.raises(ValueError):
+        pf.lookup('residential', simple_dev_inputs, solver='newton')
+
+
+@pytest.mark.parametrize('fars, max_retail_height, max_industrial_height', [
+    (None, 2.0, 3.0),
+    (None, 2.5, 1.5),
+    (list(np.arange(.1, 15, .05)), 2.5, 1.5)])
+def test_lookup_breakpoints_solver_height_cutoffs(
+        random_dev_inputs, fars, max_retail_height, max_industrial_height):
+    settings = sqpf.SqFtProForma.get_defaults()
+    if fars is not None:
+        settings['fars'] = fars
+    settings['max_retail_height'] = max_retail_height
+    settings['max_industrial_height'] = max_industrial_height
+    pf = sqpf.SqFtProForma(**settings)
+
+    for form in pf.forms_to_test:
+        expected = pf.lookup(form, random_dev_inputs)
+        out = pf.lookup(form, random_dev_inputs, solver='breakpoints')
+        pd.testing.assert_frame_equal(out, expected)
+
+
+def test_lookup_sparse_solver(random_dev_inputs):
+    pf = sqpf.SqFtProForma.from_defaults()
+    random_dev_inputs['max_height'] = np.where(
+        np.arange(len(random_dev_inputs)) % 7 == 0, np.nan, 40.)
+
+    for form in pf.forms_to_test:
+        expected = pf.lookup(form, random_dev_inputs)
+        out = pf.lookup(form, random_dev_inputs, solver='sparse')
+        pd.testing.assert_frame_equal(out, expected)
+
+    expected = pf.lookup_all(random_dev_inputs)
+    out = pf.lookup_all(random_dev_inputs, solver='sparse')
+    pd.testing.assert_frame_equal(out, expected)
+
+
+def test_lookup_fused_solver(random_dev_inputs, monkeypatch):
+    # run the kernel as plain python so the test does not need numba
+    monkeypatch.setattr(sqpf, '_fused_kernel', sqpf._fused_best_far)
+    pf = sqpf.SqFtProForma.from_defaults()
+
+    for form in pf.forms_to_test:
+        expected = pf.lookup(form, random_dev_inputs)
+        out = pf.lookup(form, random_dev_inputs, solver='fused')
+        pd.testing.assert_frame_equal(out, expected)
+
+    # the callbacks force the numpy path
+    def modify_profits(pf, form, df, profit):
+        return profit * 2
+
+    expected = pf.lookup('residential', random_dev_inputs,
+                         modify_profits=modify_profits)
+    out = pf.lookup('residential', random_dev_inputs,
+                    modify_profits=modify_profits, solver='fused')
+    pd.testing.assert_frame_equal(out, expected)
+
+
+def test_lookup_adjustments(random_dev_inputs):
+    pf = sqpf.SqFtProForma.from_defaults()
+    random_dev_inputs['rent_factor'] = np.linspace(.5, 1.5,
+                                                   len(random_dev_inputs))
+    profit_offset = pd.Series(-1e5, index=random_dev_inputs.index)
+
+    def modify_revenues(pf, form, df, revenues):
+        return revenues * df.rent_factor.values
+
+    def modify_costs(pf, form, df, costs):
+        return costs * 1.1
+
+    def modify_profits(pf, form, df, profits):
+        return profits + profit_offset.loc[df.index].values
+
+    adjustments = {form: {'revenue_factor': 'rent_factor',
+                          'cost_factor': 1.1,
+                          'profit_offset': profit_offset}
+                   for form in pf.forms_to_test}
+
+    expected = pf.lookup('residential', random_dev_inputs.copy(),
+                         modify_revenues=modify_revenues,
+                         modify_costs=modify_costs,
+                         modify_profits=modify_profits)
+    for solver in ['grid', 'breakpoints', 'sparse']:
+        out = pf.lookup('residential', random_dev_inputs, solver=solver,
+                        adjustments=adjustments)
+        pd.testing.assert_frame_equal(out, expected)
+
+    expected = pf.lookup_all(random_dev_inputs,
+                             modify_revenues=modify_revenues,
+                             modify_costs=modify_costs,
+                             modify_profits=modify_profits)
+    out = pf.lookup_all(random_dev_inputs, adjustments=adjustments)
+    pd.testing.assert_frame_equal(out, expected)
+    out = pf.lookup_all(random_dev_inputs, adjustments=adjustments,
+                        chunksize=100)
+    pd.testing.assert_frame_equal(out, expected)
+
+    with pytest.raises(ValueError):
+        pf.lookup('residential', random_dev_inputs,
+                  adjustments={'residential': {'rent_factor': 2}})
+    with pytest.raises(ValueError):
+        pf.lookup('residential', random_dev_inputs,
+                  adjustments={'residential': {'cost_factor': [1, 2]}})
+
+
+def test_lookup_scenarios(random_dev_inputs):
+    pf = sqpf.SqFtProForma.from_defaults()
+    scenarios = pd.DataFrame({'cap_rate': [.05, .06],
+                              'interest_rate': [.05, .07],
+                              'profit_factor': [1, .8]},
+                             index=['base', 'tight'])
+
+    out = pf.lookup_scenarios('residential', random_dev_inputs, scenarios)
+    assert out.index.names[0] == 'scenario'
+    pd.testing.assert_frame_equal(
+        out.loc['base'], pf.lookup('residential', random_dev_inputs),
+        check_names=False)
+
+    pf.cap_rate = .06
+    pf.interest_rate = .07
+    expected = pf.lookup('residential', random_dev_inputs,
+                         adjustments={'residential': {'profit_factor': .8}})
+    pd.testing.assert_frame_equal(out.loc['tight'], expected,
+                                  check_names=False)
+
+    chunked = pf.lookup_scenarios('residential', random_dev_inputs,
+                                  scenarios, chunksize=100)
+    pd.testing.assert_frame_equal(chunked, out)
+
+    with pytest.raises(ValueError):
+        pf.lookup_scenarios('residential', random_dev_inputs,
+                            {'height_per_story': [10]})
+
+
+def test_lookup_float32(random_dev_inputs):
+    pf = sqpf.SqFtProForma.from_defaults()
+    settings = sqpf.SqFtProForma.get_defaults()
+    settings['dtype'] = 'float32'
+    pf32 = sqpf.SqFtProForma(**settings)
+
+    assert pf32.to_dict['dtype'] == 'float32'
+    for dev_info in pf32.reference_dict.values():
+        assert (dev_info.dtypes == np.float32).all()
+
+    for form in pf.forms_to_test:
+        expected = pf.lookup(form, random_dev_inputs)
+        out = pf32.lookup(form, random_dev_inputs)
+        assert out.max_profit.dtype == np.float32
+
+        assert out.index.equals(expected.index)
+        assert (out.parking_config == expected.parking_config).all()
+        assert np.allclose(out.max_profit_far, expected.max_profit_far,
+                           rtol=1e-6)
+        assert np.allclose(out.max_profit, expected.max_profit,
+                           rtol=1e-4, atol=10)
+        assert np.allclose(out.total_cost, expected.total_cost, rtol=1e-5)
+
+    expected = pf.lookup_all(random_dev_inputs)
+    out = pf32.lookup_all(random_dev_inputs)
+    assert out.columns.equals(expected.columns)
+    assert np.allclose(out.xs('max_profit', axis=1, level=1),
+                       expected.xs('max_profit', axis=1, level=1),
+                       rtol=1e-4, atol=10, equal_nan=True)
+
+
+def test_reference_cache(tmpdir):
+    cache_dir = str(tmpdir.join('cache'))
+    expected = sqpf.SqFtProForma.from_defaults()
+
+    pf = sqpf.SqFtProForma.from_defaults(cache_dir=cache_dir)
+    assert os.path.exists(pf.reference_cache_path)
+
+    cached = sqpf.SqFtProForma.from_defaults(cache_dir=cache_dir)
+    assert sorted(cached.reference_dict) == sorted(expected.reference_dict)
+    for key, df in expected.reference_dict.items():
+        pd.testing.assert_frame_equal(cached.reference_dict[key], df)
+
+
+def test_reference_cache_invalidation(tmpdir):
+    cache_dir = str(tmpdir)
+    pf = sqpf.SqFtProForma.from_defaults(cache_dir=cache_dir)
+
+    settings = sqpf.SqFtProForma.get_defaults()
+    settings['building_efficiency'] = .8
+    changed = sqpf.SqFtProForma(cache_dir=cache_dir, **settings)
+    assert changed.reference_hash != pf.reference_hash
+    assert changed.reference_cache_path != pf.reference_cache_path
+
+    settings = sqpf.SqFtProForma.get_defaults()
+    settings['building_efficiency'] = .8
+    expected = sqpf.SqFtProForma(**settings)
+    key = ('residential', 'surface')
+    pd.testing.assert_frame_equal(changed.reference_dict[key],
+                                  expected.reference_dict[key])
+    assert len(os.listdir(cache_dir)) == 2
+
+
+def test_reference_hash_arrays(simple_dev_inputs):
+    def with_arrays():
+        settings = sqpf.SqFtProForma.get_defaults()
+        settings['heights_for_costs'] = np.array(
+            settings['heights_for_costs'])
+        settings['fars'] = np.array(settings['fars'])
+        return sqpf.SqFtProForma(**settings)
+
+    pf = sqpf.SqFtProForma.from_defaults()
+    arrays = with_arrays()
+    assert arrays.reference_hash == with_arrays().reference_hash
+
+    out = arrays.lookup('residential', simple_dev_inputs, incremental=True)
+    pd.testing.assert_frame_equal(out,
+                                  pf.lookup('residential', simple_dev_inputs))
+
+
+def test_lookup_incremental(random_dev_inputs):
+    pf = sqpf.SqFtProForma.from_defaults()
+    df = random_dev_inputs
+
+    out = pf.lookup_all(df, incremental=True)
+    pd.testing.assert_frame_equal(out, pf.lookup_all(df))
+
+    df2 = df.copy()
+    df2.loc[df2.index[::7], 'residential'] *= 1.5
+    df2 = df2.drop(df2.index[:10])
+    out = pf.lookup_all(df2, incremental=True)
+    pd.testing.assert_frame_equal(out, pf.lookup_all(df2))
+
+    out = pf.lookup('residential', df2, incremental=True)
+    pd.testing.assert_frame_equal(out, pf.lookup('residential', df2.copy()))
+
+    with pytest.raises(ValueError):
+        pf.lookup('residential', df2, modify_df=lambda self, form, df: df,
+                  incremental=True)
+
+
+def test_lookup_incremental_forms_out_of_sync(random_dev_inputs):
+    pf = sqpf.SqFtProForma.from_defaults()
+    df = random_dev_inputs
+    forms = ['residential', 'office']
+
+    # only residential is cached, so every parcel is changed for office
+    pf.lookup('residential', df, incremental=True)
+    out = pf.lookup_all(df, forms=forms, incremental=True)
+    pd.testing.assert_frame_equal(out, pf.lookup_all(df, forms=forms))
+
+    # residential is cached for different parcels than office
+    df2 = df.copy()
+    df2.loc[df2.index[::5], 'office'] *= 1.5
+    pf.lookup('residential', df2.iloc[::2], incremental=True)
+    out = pf.lookup_all(df2, forms=forms, incremental=True)
+    pd.testing.assert_frame_equal(out, pf.lookup_all(df2, forms=forms))
+
+
+def test_lookup_spans(simple_dev_inputs):
+    pf = sqpf.SqFtProForma.from_defaults()
+    spans = []
+    with utils.SpanRecorder(callback=lambda *span: spans.append(span),
+                            memory=True) as recorder:
+        pf.lookup('residential', simple_dev_inputs)
+
+    names = [name for name, seconds, peak in recorder.spans]
+    assert names[-1] == 'lookup'
+    assert names.count('lookup.profit') == len(pf.parking_configs)
+    assert spans == recorder.spans
+
+    summary = recorder.summary()
+    assert summary.loc['lookup.profit', 'calls'] == len(pf.parking_configs)
+    assert (summary.peak_memory > 0).all()
+    assert 'lookup.max_profit_parking' in recorder.report()
+
+    # nothing is recorded once the recorder is closed
+    pf.lookup('residential', simple_dev_inputs)
+    assert len(recorder.spans) == len(names)
+
+
+def test_max_profit_parking():
+    df = pd.DataFrame({'parking_config': ['surface', 'deck', 'surface',
+                                          'underground', 'deck'],
+                       'max_profit': [1.0, 2.0, 3.0, 3.0, 0.5],
+                       'building_sqft': [10.0, 20.0, 30.0, 40.0, 50.0]},
+                      index=['b', 'b', 'a', 'a', 'c'],
+                      columns=['building_sqft', 'parking_config',
+                               'max_profit'])
+    result = sqpf.SqFtProForma._max_profit_parking(df)
+
+    assert result.index.tolist() == ['a', 'b', 'c']
+    assert result.columns.tolist() == ['parking_config', 'building_sqft',
+                                       'max_profit']
+    # ties go to the first configuration alphabetically
+    assert result.parking_config.tolist() == ['surface', 'deck', 'deck']
+    assert result.building_sqft.tolist() == [30.0, 20.0, 50.0]
+
+
+def test_lookup_columns(random_dev_inputs):
+    pf = sqpf.SqFtProForma.from_defaults()
+    df = random_dev_inputs
+    expected = pf.lookup_all(df)
+
+    columns = {col: df[col].values for col in df.columns}
+    columns['parcel_id'] = df.index.values
+    out = pf.lookup_all(columns)
+    assert out.index.name == 'parcel_id'
+    out.index.name = df.index.name
+    pd.testing.assert_frame_equal(out, expected)
+
+    records = df.reset_index(drop=True).to_records(index=False)
+    out = pf.lookup('residential', records, chunksize=100)
+    expected = pf.lookup('residential', df.reset_index(drop=True))
+    pd.testing.assert_frame_equal(out, expected)
+
+    with pytest.raises(ValueError):
+        pf.lookup('residential', columns, modify_revenues=revenue_callback)
+
+
+def test_parcel_columns():
+    data = {'parcel_size': np.array([1.0, 2.0, 3.0]),
+            'land_cost': np.array([4.0, 5.0, 6.0])}
+    parcels = sqpf.ParcelColumns(data)
+    assert len(parcels) == 3
+    assert parcels.index.tolist() == [0, 1, 2]
+    # columns are not copied
+    assert parcels['parcel_size'] is data['parcel_size']
+    assert 'land_cost' in parcels and 'max_far' not in parcels
+
+    sliced = parcels.iloc[1:]
+    assert sliced.index.tolist() == [1, 2]
+    assert np.shares_memory(sliced['land_cost'], data['land_cost'])
+
+    df = parcels.with_columns({'max_far': np.ones(3)}).to_frame()
+    assert df.columns.tolist() == ['parcel_size', 'land_cost', 'max_far']
+
+
+def test_parcel_context(simple_dev_inputs):
+    pf = sqpf.SqFtProForma.from_defaults()
+    df = simple_dev_inputs
+    context = pf.parcel_context('residential', df)
+
+    assert context.index.equals(df.index)
+    assert context.columns.tolist() == ['weighted_rent',
+                                        'max_far_from_heights',
+                                        'min_max_fars', 'evaluated']
+    assert np.allclose(context.weighted_rent, df.residential)
+    assert np.allclose(context.max_far_from_heights,
+                       df.max_height / pf.height_per_story *
+                       pf.parcel_coverage)
+    assert np.allclose(context.min_max_fars,
+                       np.fmin(context.max_far_from_heights, df.max_far))
+    assert context.evaluated.all()
@@ -1,6 +1,20 @@
 import yaml
 import os
+import json
+import time
+from contextlib import contextmanager
 import numpy as np
+import pandas as pd
+
+# SpanRecorders collecting spans, innermost last
+_recorders = []
+
+# clock used to time spans, time.perf_counter is not in Python 2
+_clock = getattr(time, 'perf_counter', time.time)
+
+# Parquet schema metadata key under which the (form, attribute) columns of
+# a feasibility table are kept
+PARQUET_COLUMNS_KEY = b'developer.columns'
 
 
 def ordered_yaml(cfg):
@@ -124,3 +138,248 @@ def columnize(iterable):
 
     column = np.reshape(iterable, (-1, 1))
     return column
+
+
+def to_parquet(df, path, **kwargs):
+    """
+    Write a DataFrame to a Parquet file with pyarrow, keeping its index.
+    The two-level (form, attribute) columns of a feasibility table are
+    stored as "form/attribute" columns and restored by read_parquet().
+
+    Parameters
+    ----------
+    df : DataFrame
+        A feasibility table, as returned by SqFtProForma.lookup_all(), or a
+        DataFrame with flat columns, such as the new buildings returned by
+        Developer.pick()
+    path : str or file like
+        Where to write the file
+    kwargs
+        Passed to pyarrow.parquet.write_table(), e.g. compression
+
+    Returns
+    -------
+    None
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    metadata = {}
+    if df.columns.nlevels == 2:
+        columns = [['{}/{}'.format(*col), col[0], col[1]]
+                   for col in df.columns]
+        df = df.copy(deep=False)
+        df.columns = [col[0] for col in columns]
+        metadata[PARQUET_COLUMNS_KEY] = json.dumps(columns).encode()
+    elif df.columns.nlevels > 2:
+        raise ValueError('only DataFrames with one or two column levels '
+                         'can be written')
+
+    table = pa.Table.from_pandas(df, preserve_index=True)
+    metadata.update(table.schema.metadata or {})
+    pq.write_table(table.replace_schema_metadata(metadata), path, **kwargs)
+
+
+def read_parquet(path, forms=None, columns=None, memory_map=True):
+    """
+    Read a DataFrame written by to_parquet(), only loading the columns
+    which are asked for.
+
+    Parameters
+    ----------
+    path : str or file like
+        The file to read
+    forms : str or list of strings, optional
+        For a feasibility table, the forms to read, by default all of them
+    columns : list of strings, optional
+        The columns to read - for a feasibility table, the attributes
+        (e.g. max_profit or building_sqft) to read for every form.  By
+        default all of them.
+    memory_map : bool, optional
+        Whether to memory map the file rather than reading it into memory
+
+    Returns
+    -------
+    df : DataFrame
+        Indexed as when it was written, with two-level (form, attribute)
+        columns for a feasibility table
+    """
+    import pyarrow.parquet as pq
+
+    metadata = pq.read_schema(path, memory_map=memory_map).metadata or {}
+    if PARQUET_COLUMNS_KEY not in metadata:
+        table = pq.read_table(path, columns=columns, memory_map=memory_map,
+                              use_pandas_metadata=True)
+        return table.to_pandas()
+
+    if isinstance(forms, str):
+        forms = [forms]
+    selected = [col for col in json.loads(metadata[PARQUET_COLUMNS_KEY])
+                if (forms is None or col[1] in forms) and
+                (columns is None or col[2] in columns)]
+    names = [col[0] for col in selected]
+
+    table = pq.read_table(path, columns=names, memory_map=memory_map,
+                          use_pandas_metadata=True)
+    df = table.to_pandas()[names]
+    # from_arrays rather than from_tuples, which cannot infer the number
+    # of levels when nothing is selected
+    df.columns = pd.MultiIndex.from_arrays([[col[1] for col in selected],
+                                            [col[2] for col in selected]])
+    return df
+
+
+@contextmanager
+def span(name):
+    """
+    Time a stage of a computation, e.g. ``with span('lookup.profit'):``.
+    The time (and memory, if requested) is passed to every active
+    SpanRecorder.  When no recorder is active this does nothing, so spans
+    can be left in hot paths.
+
+    Parameters
+    ----------
+    name : str
+        Name of the stage, prefixed by the name of the method it is in
+    """
+    if not _recorders:
+        yield
+        return
+
+    recorders = list(_recorders)
+    memory = any(recorder.memory for recorder in recorders)
+    if memory:
+        SpanRecorder._enter_memory()
+    start = _clock()
+    try:
+        yield
+    finally:
+        seconds = _clock() - start
+        peak = SpanRecorder._exit_memory() if memory else None
+        for recorder in recorders:
+            recorder._record(name, seconds, peak)
+
+
+class SpanRecorder(object):
+    """
+    Collects the spans timed with span() while it is active, e.g.::
+
+        with SpanRecorder() as spans:
+            pf.lookup('residential', df)
+        print(spans.report())
+
+    Spans recorded by worker processes (n_jobs) are not collected.
+
+    Parameters
+    ----------
+    callback : function, optional
+        Called with (name, seconds, peak_memory) when each span ends, e.g.
+        to send them to a logger or a metrics system
+    memory : bool, optional
+        Also record the peak memory allocated by Python and numpy during
+        each span, in bytes above the memory in use when it started.  This
+        uses tracemalloc, which slows everything down noticeably.  Before
+        Python 3.9, where tracemalloc cannot reset its peak, the peak is
+        the highest memory since tracing started, so it can include the
+        memory used before the span.
+
+    Attributes
+    ----------
+    spans : list of tuples
+        (name, seconds, peak_memory) of each span in the order they ended,
+        so nested spans come before the spans that contain them.
+        peak_memory is None unless memory is True.
+    """
+
+    # for each span being measured, the traced memory when it started and
+    # the highest peak of the spans it contains
+    _memory_stack = []
+    _memory_users = 0
+
+    def __init__(self, callback=None, memory=False):
+        self.callback = callback
+        self.memory = memory
+        self.spans = []
+
+    def __enter__(self):
+        if self.memory:
+            import tracemalloc
+            if SpanRecorder._memory_users == 0 and \
+                    not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+            SpanRecorder._memory_users += 1
+        _recorders.append(self)
+        return self
+
+    def __exit__(self, *exc):
+        _recorders.remove(self)
+        if self.memory:
+            SpanRecorder._memory_users -= 1
+            if getattr(self, '_started_tracing', False):
+                import tracemalloc
+                tracemalloc.stop()
+                self._started_tracing = False
+        return False
+
+    @staticmethod
+    def _enter_memory():
+        import tracemalloc
+        current, peak = tracemalloc.get_traced_memory()
+        stack = SpanRecorder._memory_stack
+        if stack:
+            # remember the peak of the enclosing span before it is reset
+            stack[-1][1] = max(stack[-1][1], peak)
+        stack.append([current, 0])
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+
+    @staticmethod
+    def _exit_memory():
+        import tracemalloc
+        start, inner_peak = SpanRecorder._memory_stack.pop()
+        peak = max(tracemalloc.get_traced_memory()[1], inner_peak)
+        stack = SpanRecorder._memory_stack
+        if stack:
+            stack[-1][1] = max(stack[-1][1], peak)
+        return peak - start
+
+    def _record(self, name, seconds, peak):
+        self.spans.append((name, seconds, peak))
+        if self.callback is not None:
+            self.callback(name, seconds, peak)
+
+    def summary(self):
+        """
+        Summarize the recorded spans by name.
+
+        Returns
+        -------
+        summary : DataFrame
+            Indexed by span name, in the order each name was first
+            recorded, with the number of calls, the total and mean seconds
+            and the largest peak memory (NaN unless memory is True)
+        """
+        df = pd.DataFrame(self.spans, columns=['name', 'seconds', 'peak'])
+        grouped = df.groupby('name', sort=False)
+        summary = pd.DataFrame({'calls': grouped.seconds.count(),
+                                'seconds': grouped.seconds.sum(),
+                                'mean_seconds': grouped.seconds.mean(),
+                                'peak_memory': grouped.peak.max()},
+                               columns=['calls', 'seconds', 'mean_seconds',
+                                        'peak_memory'])
+        summary.index.name = 'span'
+        return summary
+
+    def report(self):
+        """
+        The summary() as a table of text.
+
+        Returns
+        -------
+        report : str
+        """
+        summary = self.summary()
+        if not self.memory:
+            del summary['peak_memory']
+        return summary.to_string()
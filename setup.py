@@ -19,14 +19,16 @@ setup(
         'Programming Language :: Python :: 2.7',
         'Programming Language :: Python :: 3.5'
     ],
-    packages=find_packages(exclude=['*.tests']),
+    packages=find_packages(exclude=['*.tests', 'benchmarks']),
     install_requires=[
-        'numpy >= 1.1.0',
+        'numpy >= 1.17.0',
         'pandas >= 0.16.0',
         'orca >= 1.3.0',
         'urbansim >= 0.1.1',
     ],
     extras_require={
-        'pandana': ['pandana>=0.1']
+        'pandana': ['pandana>=0.1'],
+        'numba': ['numba'],
+        'parquet': ['pyarrow']
     }
 )